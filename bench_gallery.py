@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import statistics
+import subprocess
+
+# The GUI phases run headless
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_MIX = "jpeg=70,png=12,bmp=6,gif=8,large_gif=4"
+FILES_PER_FOLDER = 500
+TEMPLATES_PER_FORMAT = 4
+WINDOW_SIZE = (1200, 900)
+
+
+def make_template(kind, path, seed):
+    from PIL import Image
+    rng = random.Random(seed)
+
+    def picture(width, height, mode="RGB"):
+        gradient = Image.linear_gradient("L").resize((width, height)).rotate(rng.randrange(360))
+        noise = Image.effect_noise((width, height), 40)
+        bands = [gradient, noise, Image.blend(gradient, noise, rng.random())]
+        if mode == "RGBA":
+            bands.append(gradient)
+        return Image.merge(mode, bands[:len(mode)])
+
+    def animation(width, height, frame_count):
+        base = picture(width, height).convert("P", palette=Image.ADAPTIVE)
+        frames = [base.rotate(i * 360 / frame_count) for i in range(frame_count)]
+        frames[0].save(path, save_all=True, append_images=frames[1:], duration=40, loop=0)
+
+    if kind == "jpeg":
+        picture(2400, 1600).save(path, quality=90)
+    elif kind == "png":
+        picture(1600, 1200, "RGBA").save(path)
+    elif kind == "bmp":
+        picture(1024, 768).save(path)
+    elif kind == "gif":
+        animation(400, 300, 24)
+    elif kind == "large_gif":
+        animation(800, 600, 200)
+    else:
+        raise ValueError(f"Unknown image kind {kind}")
+
+
+EXTENSIONS = {"jpeg": ".jpg", "png": ".png", "bmp": ".bmp", "gif": ".gif", "large_gif": ".gif"}
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in EXTENSIONS:
+            raise argparse.ArgumentTypeError(f"Unknown image kind {kind!r}, expected one of {', '.join(EXTENSIONS)}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def generate_tree(tree, count, mix, seed=0):
+    # Renders a few templates per kind and copies them around; copying keeps
+    # generating 100k images cheap while every file still has to be decoded.
+    rng = random.Random(seed)
+    templates_folder = os.path.join(os.path.dirname(tree), "templates")
+    os.makedirs(templates_folder, exist_ok=True)
+    templates = {}
+    for kind in mix:
+        templates[kind] = []
+        for number in range(TEMPLATES_PER_FORMAT):
+            path = os.path.join(templates_folder, f"{kind}-{number}{EXTENSIONS[kind]}")
+            if not os.path.exists(path):
+                make_template(kind, path, seed=number)
+            templates[kind].append(path)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    for number in range(count):
+        folder = os.path.join(tree, f"folder-{number // FILES_PER_FOLDER:04d}")
+        if number % FILES_PER_FOLDER == 0:
+            os.makedirs(folder, exist_ok=True)
+        kind = rng.choices(kinds, weights)[0]
+        shutil.copyfile(rng.choice(templates[kind]), os.path.join(folder, f"image-{number:06d}{EXTENSIONS[kind]}"))
+
+
+def peak_rss_mb(who):
+    import resource
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    if not samples:
+        return None
+    return {
+        "mean": round(statistics.mean(samples), 3),
+        "p50": round(samples[len(samples) // 2], 3),
+        "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "max": round(samples[-1], 3),
+    }
+
+
+def cache_options(args):
+    import gallery
+    return gallery.CacheOptions(args.cache_format, args.animation_format)
+
+
+def run_build(args):
+    import resource
+    import gallery
+    count = sum(1 for _ in gallery.scan_image_files(args.tree))
+    # Per-stage timings of the cold run; the counters cost next to nothing next to a decode
+    gallery.metrics.configure(True)
+    start = time.perf_counter()
+    gallery.update_cache(args.tree, args.cache, workers=args.workers, options=cache_options(args))
+    cold = time.perf_counter() - start
+    gallery.metrics.configure(False)
+    start = time.perf_counter()
+    gallery.update_cache(args.tree, args.cache, workers=args.workers, options=cache_options(args))
+    warm = time.perf_counter() - start
+    return {
+        "images": count,
+        "cold_seconds": round(cold, 3),
+        "cold_thumbnails_per_second": round(count / cold, 1) if cold else None,
+        "warm_seconds": round(warm, 3),
+        "warm_images_per_second": round(count / warm, 1) if warm else None,
+        "build_peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+        "workers_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "cold_stages_ms": {row["name"]: {key: row.get(key) for key in ("count", "mean_ms", "p95_ms", "total_ms")}
+                           for row in gallery.metrics.summary()},
+    }
+
+
+def pump(app, until, timeout):
+    deadline = time.perf_counter() + timeout
+    while not until() and time.perf_counter() < deadline:
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def open_gallery(args):
+    # Returns the app, the window showing args.tree, the seconds open_folder took and the seconds
+    # from startup to the first viewport paint with a decoded thumbnail, or None on timeout
+    import gallery_ui
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QObject, QEvent
+
+    class PaintProbe(QObject):
+        # Notes the first viewport paint that has a decoded thumbnail to show
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+            self.first_paint = None
+
+        def eventFilter(self, source, event):
+            if event.type() == QEvent.Paint and self.first_paint is None and len(self.model.pixmaps):
+                self.first_paint = time.perf_counter()
+            return False
+
+    start = time.perf_counter()
+    app = QApplication.instance() or QApplication([])
+    window = gallery_ui.ImageGallery()
+    probe = PaintProbe(window.model)
+    window.view.viewport().installEventFilter(probe)
+    window.resize(*WINDOW_SIZE)
+    window.show()
+    open_start = time.perf_counter()
+    window.open_folder(args.tree, args.cache, cache_options(args))
+    open_seconds = time.perf_counter() - open_start
+    pump(app, lambda: probe.first_paint is not None, args.timeout)
+    first_paint = probe.first_paint - start if probe.first_paint else None
+    return app, window, open_seconds, first_paint
+
+
+def run_cold_gui(args):
+    # Startup on an empty cache, where the grid fills as thumbnails stream in from the build
+    import resource
+    app, window, open_seconds, first_paint = open_gallery(args)
+    result = {
+        "cold_open_folder_seconds": round(open_seconds, 3),
+        "cold_first_paint_seconds": round(first_paint, 3) if first_paint is not None else None,
+        "cold_gui_peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+    }
+    # Closing cancels the build; the batches already running finish first
+    window.close()
+    return result
+
+
+def run_gui(args):
+    import resource
+    from PyQt5.QtCore import QEvent, QPoint, Qt
+    from PyQt5.QtGui import QMouseEvent
+
+    def visible_decoded():
+        rows = window.view.visible_rows()
+        return all(window.model.items[row]["resized"] in window.model.pixmaps for row in rows)
+
+    app, window, open_seconds, first_paint = open_gallery(args)
+    pump(app, lambda: window.cache_worker is None, args.timeout)
+
+    lazy_load = []
+    scroll_steps = []
+    scroll_settle = []
+    scrollbar = window.view.verticalScrollBar()
+    for _ in range(args.scroll_steps):
+        if scrollbar.value() >= scrollbar.maximum():
+            scrollbar.setValue(0)
+        step_start = time.perf_counter()
+        scrollbar.setValue(scrollbar.value() + window.view.viewport().height())
+        app.processEvents()
+        window.view.viewport().repaint()
+        scroll_steps.append((time.perf_counter() - step_start) * 1000)
+        pump(app, visible_decoded, args.timeout)
+        scroll_settle.append((time.perf_counter() - step_start) * 1000)
+        lazy_start = time.perf_counter()
+        window.lazy_load_images()
+        lazy_load.append((time.perf_counter() - lazy_start) * 1000)
+
+    # Hover steps move the pointer to the next tile in the viewport; settling waits for the zoom
+    # animation and the zoomed level, which is when a relayout of every row used to show up
+    hover_steps = []
+    hover_settle = []
+    scrollbar.setValue(0)
+    app.processEvents()
+    view = window.view
+    tiles = [view.visualRect(window.model.index(row)).center() for row in view.visible_rows()]
+    for number in range(args.hover_steps if tiles else 0):
+        step_start = time.perf_counter()
+        app.sendEvent(view.viewport(), QMouseEvent(QEvent.MouseMove, tiles[number % len(tiles)], Qt.NoButton, Qt.NoButton, Qt.NoModifier))
+        app.processEvents()
+        view.viewport().repaint()
+        hover_steps.append((time.perf_counter() - step_start) * 1000)
+        pump(app, lambda: not any(animation.state() for animation in view.animations.values()), args.timeout)
+        hover_settle.append((time.perf_counter() - step_start) * 1000)
+    app.sendEvent(view.viewport(), QMouseEvent(QEvent.MouseMove, QPoint(-1, -1), Qt.NoButton, Qt.NoButton, Qt.NoModifier))
+
+    resizes = []
+    for number in range(args.resize_steps):
+        resize_start = time.perf_counter()
+        window.resize(WINDOW_SIZE[0] - (300 if number % 2 == 0 else 0), WINDOW_SIZE[1])
+        app.processEvents()
+        window.view.viewport().repaint()
+        resizes.append((time.perf_counter() - resize_start) * 1000)
+
+    result = {
+        "rows": window.model.rowCount(),
+        "open_folder_seconds": round(open_seconds, 3),
+        "first_paint_seconds": round(first_paint, 3) if first_paint is not None else None,
+        "scroll_step_ms": summarize(scroll_steps),
+        "scroll_settle_ms": summarize(scroll_settle),
+        "lazy_load_ms": summarize(lazy_load),
+        "hover_step_ms": summarize(hover_steps),
+        "hover_settle_ms": summarize(hover_settle),
+        "resize_relayout_ms": summarize(resizes),
+        "pixmap_cache_mb": round(window.model.pixmaps.total_bytes / (1024 * 1024), 1),
+        "gui_peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+    }
+    window.close()
+    return result
+
+
+def run_generate(args):
+    start = time.perf_counter()
+    generate_tree(args.tree, args.count, args.mix)
+    return {"generate_seconds": round(time.perf_counter() - start, 3)}
+
+
+PHASES = {"generate": run_generate, "cold_gui": run_cold_gui, "build": run_build, "gui": run_gui}
+
+
+def run_phase(args, phase, size, tree, cache):
+    # Every phase runs in its own interpreter so peak RSS is measured per phase and
+    # size; Linux carries ru_maxrss across exec, so the parent stays small too
+    with tempfile.NamedTemporaryFile("r", suffix=".json", delete=False) as result_file:
+        result_path = result_file.name
+    command = [sys.executable, os.path.abspath(__file__), "--phase", phase, "--count", str(size), "--tree", tree, "--cache", cache,
+               "--result-file", result_path, "--cache-format", args.cache_format,
+               "--animation-format", args.animation_format, "--scroll-steps", str(args.scroll_steps),
+               "--resize-steps", str(args.resize_steps), "--hover-steps", str(args.hover_steps), "--timeout", str(args.timeout),
+               "--mix", ",".join(f"{kind}={weight:g}" for kind, weight in args.mix.items())]
+    if args.workers:
+        command += ["--workers", str(args.workers)]
+    output = None if args.verbose else subprocess.DEVNULL
+    try:
+        subprocess.run(command, check=True, stdout=output, cwd=os.path.dirname(os.path.abspath(__file__)))
+        with open(result_path) as result_file:
+            return json.load(result_file)
+    finally:
+        os.remove(result_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmarks for the gallery thumbnail pipeline and grid.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of images to benchmark")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"image kinds and weights (default {DEFAULT_MIX})")
+    parser.add_argument("--workdir", help="where synthetic trees and caches go (default: a temporary folder)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated trees and caches")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--workers", type=int, help="thumbnail worker processes (default: CPU count)")
+    parser.add_argument("--cache-format", default="files")
+    parser.add_argument("--animation-format", default="gif")
+    parser.add_argument("--scroll-steps", type=int, default=30)
+    parser.add_argument("--resize-steps", type=int, default=10)
+    parser.add_argument("--hover-steps", type=int, default=30)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for the GUI to settle")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline output")
+    # Internal: run a single phase and write its result to --result-file
+    parser.add_argument("--phase", choices=list(PHASES), help=argparse.SUPPRESS)
+    parser.add_argument("--count", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--tree", help=argparse.SUPPRESS)
+    parser.add_argument("--cache", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        result = PHASES[args.phase](args)
+        with open(args.result_file, "w") as result_file:
+            json.dump(result, result_file)
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="gallery-bench-")
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "cache_format": args.cache_format,
+        "animation_format": args.animation_format,
+        "mix": args.mix,
+        "runs": [],
+    }
+    try:
+        for size in args.sizes:
+            print(f"Benchmarking {size} images in {workdir}", file=sys.stderr)
+            tree = os.path.join(workdir, f"images-{size}")
+            cache = os.path.join(workdir, f"cache-{size}")
+            run = {"size": size}
+            run.update(run_phase(args, "generate", size, tree, cache))
+            # The cold start gets a cache of its own, so the build below still starts from nothing
+            run.update(run_phase(args, "cold_gui", size, tree, cache + "-cold"))
+            shutil.rmtree(cache + "-cold", ignore_errors=True)
+            run.update(run_phase(args, "build", size, tree, cache))
+            run.update(run_phase(args, "gui", size, tree, cache))
+            results["runs"].append(run)
+            if not args.keep:
+                shutil.rmtree(tree, ignore_errors=True)
+                shutil.rmtree(cache, ignore_errors=True)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,470 +1,1453 @@
 import sys
 import os
-import shutil
 import concurrent.futures
+import collections
+import datetime
+import hashlib
+import itertools
+import sqlite3
+import threading
+import struct
+import time
+import io
 import json
+import csv
+import atexit
+import signal
+import argparse
+import shutil
+import socket
 from PIL import Image,ImageSequence
-from tkinter import filedialog, Tk
-import uuid
-from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QLabel, QScrollArea, QVBoxLayout, QWidget, QGridLayout, QHBoxLayout, QMenuBar, QAction, QMenu, QMessageBox, QCheckBox, QDialog, QDialogButtonBox
-from PyQt5.QtGui import QPixmap, QImage, QTransform, QPainter, QColor
-from PyQt5.QtCore import QSize, Qt, QEvent, QPropertyAnimation, pyqtProperty, QTimer, QRect
-from PyQt5.QtGui import QMovie
-
-
-
-def resize_image(file_path, resized_path):
-    # Create a unique dummy file to avoid conflicts
-    dummy_file = os.path.join(os.getcwd(), "working_temp_" + str(uuid.uuid4()) + os.path.splitext(file_path)[-1])
-    shutil.copy2(file_path, dummy_file)
-
-    with Image.open(dummy_file) as img:
-        if img.format == 'GIF':
-            frames = []
-            for frame in ImageSequence.Iterator(img):
-                frame = frame.copy()
-                frame.thumbnail((256, 256), Image.LANCZOS)
-                frames.append(frame)
-            frames[0].save(resized_path, save_all=True, append_images=frames[1:], duration=img.info['duration'], loop=img.info.get('loop', 0))
-        else:
-            img.thumbnail((256, 256), Image.LANCZOS)
-            img.save(resized_path)
+import multiprocessing
+# The GUI toolkits are imported only when a window is opened (gallery_ui, tkinter),
+# so build-cache runs headless and starts quickly
 
-    os.remove(dummy_file)  # Clean up the working file
 
-def process_image(file_path, original_folder, cache_resized_folder, image_data):
-    relative_path = os.path.relpath(file_path, original_folder)
-    resized_path = os.path.join(cache_resized_folder, relative_path)
-    # Check if the resized image already exists
-    if os.path.exists(resized_path):
-        print(f"Thumbnail already exists for {file_path}, skipping conversion.")
-        return
-    # Ensure the directory exists
-    os.makedirs(os.path.dirname(resized_path), exist_ok=True)
-    resize_image(file_path, resized_path)
-    image_data.append({
-        "original": os.path.abspath(file_path),
-        "resized": os.path.abspath(resized_path)
-    })
-    print(f"Resized {file_path} to {resized_path}")
-
-
-def resize_images_and_generate_json(original_folder, cache_resized_folder):
-    image_data = []
-    json_path = os.path.join(cache_resized_folder, "image_links.json")
-    if os.path.exists(json_path):
-        with open(json_path, 'r') as json_file:
-            image_data = json.load(json_file)
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        futures = []
-        for root, dirs, files in os.walk(original_folder):
-            for file in files:
-                if is_image(file):
-                    file_path = os.path.join(root, file)
-                    futures.append(executor.submit(process_image, file_path, original_folder, cache_resized_folder, image_data))
-        concurrent.futures.wait(futures)
-    # Save the JSON file
-    with open(json_path, 'w') as json_file:
-        json.dump(image_data, json_file, indent=4)
-    print(f"JSON file saved at {json_path}")
-    return json_path
 
+DISPLAY_THUMBNAIL_SIZE = (150, 150)
+ZOOM_THUMBNAIL_SIZE = (165, 165)  # DISPLAY_THUMBNAIL_SIZE at the full hover zoom
+PREVIEW_LEVEL_SIZE = (1024, 1024)
+# Every level is rendered from a single decode of the original, largest first
+PYRAMID_LEVELS = (("preview", PREVIEW_LEVEL_SIZE), ("zoom", ZOOM_THUMBNAIL_SIZE), ("resized", DISPLAY_THUMBNAIL_SIZE))
+# Each level mirrors the source tree in its own folder, so no source folder can be mistaken for a level's
+LEVEL_FOLDERS = {"resized": "thumbnails", "zoom": ".zoom", "preview": ".preview", "animation": ".animation"}
+LEVEL_NAMES = tuple(LEVEL_FOLDERS)
+# Bump when the thumbnails written for an original change; older index rows are then rebuilt.
+# Animations are versioned separately so changing their stage does not rebuild every still.
+CACHE_VERSION = 1
+# Facts about each original kept in the index next to its size and mtime, for sorting and filtering
+METADATA_FIELDS = ("width", "height", "format", "frames", "taken")
+ANIMATION_CACHE_VERSION = 2
+DEFAULT_BATCH_SIZE = 32
+CACHE_FORMATS = ("files", "pack")
+ANIMATION_FORMATS = ("gif", "webp")
+PACK_FILE_BYTES = 1024 * 1024 * 1024
+# Animated thumbnails keep at most this many frames and this many bytes of decoded frames by default
+ANIMATION_MAX_FRAMES = 48
+ANIMATION_MAX_BYTES = 4 * 1024 * 1024
+ANIMATION_DEFAULT_DURATION = 100
+# A builder claims each original in the cache's claims folder while it thumbnails it. Claims of a
+# process that is gone are taken over at once on the same machine, other machines' after this long.
+CLAIM_STALE_SECONDS = 15 * 60
+CLAIM_RETRY_SECONDS = 1
+# A builder waits this long for originals claimed by others when none of them gets done, then
+# skips them; claims left by a crash on another machine or a reused pid would otherwise stall it
+CLAIM_WAIT_SECONDS = 30
 
-def is_image(file_name):
-    image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
-    _, ext = os.path.splitext(file_name)
-    return ext.lower() in image_extensions
-class AnimatedLabel(QLabel):
-    def __init__(self, pixmap, original_path, parent):
-        super().__init__(parent)
-        self.original_pixmap = pixmap
-        self.original_path = original_path
-        self.setPixmap(pixmap)
-        self._scale_factor = 1.0
-        self.animation = QPropertyAnimation(self, b"scale_factor")
-        self.animation.setDuration(200)
-        self.hovered = False
-        self.toggled = False
-        self.parent_widget = parent
-        self.movie = None
-        self.set_default_size()
-
-    @pyqtProperty(float)
-    def scale_factor(self):
-        return self._scale_factor
-
-    @scale_factor.setter
-    def scale_factor(self, value):
-        self._scale_factor = value
-        self.update_pixmap()
-
-    def set_default_size(self):
-        if self.original_pixmap.isNull():
-            self.setFixedSize(200, 200)  # Set a larger default size if the pixmap is invalid
+# content_store is the folder of a ContentStore shared by every library, or None for thumbnails kept per library.
+# The animation budgets apply to animations made from then on; ones already cached are kept.
+CacheOptions = collections.namedtuple("CacheOptions", ["cache_format", "animation_format", "content_store", "animation_max_frames", "animation_max_bytes"],
+                                      defaults=["files", "gif", None, ANIMATION_MAX_FRAMES, ANIMATION_MAX_BYTES])
+DEFAULT_CACHE_OPTIONS = CacheOptions()
+
+
+class MetricTimer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    # Timing counters with log2 microsecond histograms. Disabled, timer() hands out a shared
+    # no-op so the hot paths only pay an attribute check. Worker processes send their
+    # counters back with every batch and they are merged into the parent's.
+    def __init__(self):
+        self.enabled = False
+        self.log_every = 0
+        self.logged = 0
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def configure(self, enabled, log_every=0):
+        self.enabled = enabled
+        self.log_every = log_every
+
+    def config(self):
+        return self.enabled, self.log_every
+
+    def timer(self, name):
+        return MetricTimer(self, name) if self.enabled else NULL_TIMER
+
+    def record(self, name, seconds):
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {"count": 0, "total": 0.0, "max": 0.0, "buckets": collections.Counter()}
+            stat["count"] += 1
+            stat["total"] += seconds
+            stat["max"] = max(stat["max"], seconds)
+            stat["buckets"][int(seconds * 1e6).bit_length()] += 1
+
+    def merge(self, stats):
+        with self.lock:
+            for name, other in stats.items():
+                stat = self.stats.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "buckets": collections.Counter()})
+                stat["count"] += other["count"]
+                stat["total"] += other["total"]
+                stat["max"] = max(stat["max"], other["max"])
+                stat["buckets"].update(other["buckets"])
+
+    def drain(self):
+        with self.lock:
+            stats, self.stats = self.stats, {}
+        return stats
+
+    def should_log(self):
+        # Per-file log lines are sampled, one in every log_every
+        if not self.log_every:
+            return False
+        self.logged += 1
+        return self.logged % self.log_every == 0
+
+    def summary(self):
+        rows = []
+        with self.lock:
+            for name, stat in sorted(self.stats.items()):
+                # Percentiles are the upper bound of the histogram bucket they fall in
+                percentiles = {}
+                seen = 0
+                for bucket, count in sorted(stat["buckets"].items()):
+                    seen += count
+                    for percentile in (50, 95, 99):
+                        if percentile not in percentiles and seen * 100 >= stat["count"] * percentile:
+                            percentiles[percentile] = round(min(1 << bucket, stat["max"] * 1e6) / 1000, 3)
+                rows.append({
+                    "name": name,
+                    "count": stat["count"],
+                    "total_ms": round(stat["total"] * 1000, 3),
+                    "mean_ms": round(stat["total"] * 1000 / stat["count"], 3),
+                    "max_ms": round(stat["max"] * 1000, 3),
+                    **{f"p{percentile}_ms": value for percentile, value in percentiles.items()},
+                    "histogram_us": {f"<{1 << bucket}": count for bucket, count in sorted(stat["buckets"].items())},
+                })
+        return rows
+
+    def dump(self, path):
+        rows = self.summary()
+        with open(path, "w", newline="") as output:
+            if path.lower().endswith(".csv"):
+                fields = ["name", "count", "total_ms", "mean_ms", "max_ms", "p50_ms", "p95_ms", "p99_ms"]
+                writer = csv.DictWriter(output, fields, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                json.dump(rows, output, indent=2)
+        print(f"Metrics written to {path}")
+
+
+metrics = Metrics()
+
+
+def cache_version(file_path):
+    return ANIMATION_CACHE_VERSION if file_path.lower().endswith('.gif') else CACHE_VERSION
+
+
+def render_levels(img):
+    levels = {}
+    for name, size in PYRAMID_LEVELS:
+        # The first level resamples the opened image in place, the smaller ones start from the previous level
+        img = img.copy() if levels else img
+        img.thumbnail(size, Image.LANCZOS, reducing_gap=2.0)
+        levels[name] = img
+    return levels
+
+
+def has_alpha(img):
+    return img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+
+
+def save_level(img, path, **params):
+    with metrics.timer("encode"):
+        data = io.BytesIO()
+        img.save(data, format=Image.registered_extensions()[os.path.splitext(path)[1].lower()], **params)
+    with metrics.timer("write"):
+        write_atomic(path, data.getbuffer())
+    return path
+
+
+def write_atomic(path, data):
+    # Written next to the destination and renamed over it, so readers and later runs see the
+    # old file or the whole new one, never a truncated one left by a crash or another builder
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.urandom(6).hex()}.tmp"
+    try:
+        with open(temporary, "xb") as output:
+            output.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def save_preview_level(img, path):
+    # Mid-size previews are kept compressed even in the pack store
+    if has_alpha(img):
+        return save_level(img, path + ".png")
+    return save_level(img.convert("RGB"), path + ".jpg", quality=90)
+
+
+def pack_level(img):
+    with metrics.timer("encode"):
+        img = img.convert("RGBA")
+        return PackedThumbnail(img.width, img.height, img.tobytes("raw", "RGBA"))
+
+
+def animation_frame_budget(img, max_frames=ANIMATION_MAX_FRAMES, max_bytes=ANIMATION_MAX_BYTES):
+    # Frames that fit max_bytes at thumbnail size, never more than max_frames
+    scale = min(1.0, DISPLAY_THUMBNAIL_SIZE[0] / img.width, DISPLAY_THUMBNAIL_SIZE[1] / img.height)
+    frame_bytes = max(1, int(img.width * scale) * int(img.height * scale) * 4)
+    return max(1, min(max_frames, max_bytes // frame_bytes))
+
+
+def resize_animation(img, path, animation_format="gif", max_frames=ANIMATION_MAX_FRAMES, max_bytes=ANIMATION_MAX_BYTES):
+    # Keeps every step-th frame; a kept frame lasts as long as the frames it stands for,
+    # so the thumbnail plays at the original speed. Returns the path written.
+    step = -(-img.n_frames // animation_frame_budget(img, max_frames, max_bytes))
+    frames = []
+    durations = []
+    for number, frame in enumerate(ImageSequence.Iterator(img)):
+        duration = frame.info.get('duration') or ANIMATION_DEFAULT_DURATION
+        if number % step:
+            durations[-1] += duration
+            continue
+        frame = frame.convert("RGBA")
+        # The poster is resampled properly, the frames in between only have to look right in motion
+        frame.thumbnail(DISPLAY_THUMBNAIL_SIZE, Image.LANCZOS if not frames else Image.BILINEAR, reducing_gap=2.0)
+        frames.append(frame)
+        durations.append(duration)
+    if animation_format == "webp":
+        save_level(frames[0], path + ".webp", save_all=True, append_images=frames[1:], duration=durations, loop=0, quality=80, method=4)
+        return path + ".webp"
+    return save_level(frames[0], path + ".gif", save_all=True, append_images=frames[1:], duration=durations, loop=img.info.get('loop', 0), disposal=2)
+
+
+def parse_exif_date(value):
+    # EXIF dates look like "2024:05:17 14:03:59"; stored as "2024-05-17 14:03:59" so they sort as text
+    try:
+        return datetime.datetime.strptime(value.strip("\x00 ")[:19], "%Y:%m:%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def read_metadata(img):
+    # Header facts only; call before draft(), which changes the reported size
+    exif = img.getexif()
+    taken = exif.get_ifd(0x8769).get(36867) or exif.get(306)  # DateTimeOriginal, else DateTime
+    return {"width": img.width, "height": img.height, "format": img.format,
+            "frames": getattr(img, "n_frames", 1), "taken": parse_exif_date(taken)}
+
+
+def read_metadata_batch(files):
+    # Runs in a worker process for index rows made before metadata was recorded; nothing is decoded
+    entries = []
+    for file_path in files:
+        try:
+            with Image.open(file_path) as img:
+                entries.append((file_path, read_metadata(img)))
+        except Exception as e:
+            print(f"Failed to read {file_path}: {e}")
+    return entries
+
+
+def resize_image(file_path, level_paths, options=DEFAULT_CACHE_OPTIONS):
+    # Decode straight from the source; no working copy of the original is made. Returns the
+    # stored location of every level, or a PackedThumbnail for the parent to pack, and the metadata.
+    stored = dict.fromkeys(LEVEL_NAMES)
+    with Image.open(file_path) as img:
+        stored.update(read_metadata(img))
+        if getattr(img, "is_animated", False):
+            # Frames are decoded and resampled one at a time, so the stage is timed as a whole
+            with metrics.timer("animation"):
+                stored["animation"] = resize_animation(img, level_paths["animation"], options.animation_format,
+                                                       options.animation_max_frames, options.animation_max_bytes)
+            # The first frame becomes the poster, stored like any still so the grid can show it without playing
+            with metrics.timer("decode"):
+                img.seek(0)
+                img = img.convert("RGBA")
         else:
-            window_width = self.parent_widget.width()
-            default_width = int(window_width * 0.3)  # 30% of the window width
-            default_height = int(default_width * (self.original_pixmap.height() / self.original_pixmap.width()))
-            self.setFixedSize(default_width, default_height)
-
-    def update_pixmap(self):
-        if self.movie:
-            self.movie.setScaledSize(self.calculate_scaled_size(self.movie))
+            with metrics.timer("decode"):
+                if img.format == 'JPEG':
+                    # Let libjpeg scale down by up to 1/8 while decoding
+                    img.draft(img.mode, PREVIEW_LEVEL_SIZE)
+                img.load()
+        with metrics.timer("resize"):
+            levels = render_levels(img)
+    stored["preview"] = save_preview_level(levels["preview"], level_paths["preview"])
+    for name in ("zoom", "resized"):
+        if options.cache_format == "pack":
+            stored[name] = pack_level(levels[name])
         else:
-            transform = QTransform().scale(self._scale_factor, self._scale_factor)
-            scaled_pixmap = self.original_pixmap.transformed(transform, Qt.SmoothTransformation)
-            self.setPixmap(scaled_pixmap)
-
-    def setMovie(self, movie):
-        self.movie = movie
-        self.movie.frameChanged.connect(self.update_frame)
-        self.movie.start()
-
-    def update_frame(self):
-        self.setPixmap(self.movie.currentPixmap())
-        self.update_pixmap()  # Ensure the pixmap is updated with the current scale factor
-
-    def calculate_scaled_size(self, movie):
-        original_size = movie.currentImage().size()
-        label_size = self.size()
-        aspect_ratio = original_size.width() / original_size.height()
-
-        if label_size.width() / aspect_ratio <= label_size.height():
-            return QSize(label_size.width(), int(label_size.width() / aspect_ratio))
+            stored[name] = save_level(levels[name], level_paths[name])
+    return stored
+
+def content_hash(file_path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as original:
+        for chunk in iter(lambda: original.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def process_stored_image(file_path, size, mtime_ns, options):
+    # Content-addressed: an original whose contents are already in the store costs a hash, not a decode
+    store = ContentStore.open_shared(options.content_store)
+    with metrics.timer("hash"):
+        digest = store.known_hash(file_path, size, mtime_ns) or content_hash(file_path)
+    levels = store.made.get(digest) or store.lookup(digest, cache_version(file_path))
+    if levels is None:
+        levels = store.make(digest, file_path, options)
+    store.made[digest] = levels
+    return dict(levels, hash=digest)
+
+
+def process_image(file_path, original_folder, cache_resized_folder, options=DEFAULT_CACHE_OPTIONS, size=None, mtime_ns=None):
+    if options.content_store:
+        levels = process_stored_image(file_path, size, mtime_ns, options)
+    else:
+        relative_path = os.path.relpath(file_path, original_folder)
+        level_paths = {name: os.path.abspath(os.path.join(cache_resized_folder, folder, relative_path))
+                       for name, folder in LEVEL_FOLDERS.items()}
+        levels = resize_image(file_path, level_paths, options)
+    if metrics.should_log():
+        print(f"Resized {file_path} to {levels['preview']}")
+    return levels
+
+
+def process_batch(files, original_folder, cache_resized_folder, options=DEFAULT_CACHE_OPTIONS, metrics_config=(False, 0)):
+    # Runs in a worker process; returns (original, levels, size, mtime_ns) index rows,
+    # the originals that failed and the metrics recorded while making them
+    metrics.configure(*metrics_config)
+    # A forked worker starts with a copy of the parent's counters; they are not this batch's
+    metrics.drain()
+    entries = []
+    failed = []
+    for file_path, size, mtime_ns in files:
+        try:
+            levels = process_image(file_path, original_folder, cache_resized_folder, options, size, mtime_ns)
+        except Exception as e:
+            print(f"Failed to resize {file_path}: {e}")
+            failed.append(file_path)
+            continue
+        entries.append((file_path, levels, size, mtime_ns))
+    return entries, failed, metrics.drain()
+
+
+def ignore_interrupts():
+    # Ctrl+C is handled by the parent, which cancels the remaining batches
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def scan_image_files(folder, recursive=True):
+    # Yields (path, size, mtime_ns) for every image below folder
+    try:
+        with os.scandir(folder) as it:
+            entries = list(it)
+    except FileNotFoundError:
+        # Deleted while being watched; its images show up as removed
+        return
+    except OSError as e:
+        print(f"Cannot scan {folder}: {e}")
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if recursive:
+                yield from scan_image_files(entry.path)
+        elif is_image(entry.name):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class FileLock:
+    # Advisory lock other processes see, and other machines on shares that forward locks (Linux
+    # NFS does for flock). Shared locks only keep exclusive ones out.
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self.file = None
+
+    def acquire(self):
+        self.file = open(self.path, "a+b")
+        if os.name != "nt":
+            import fcntl
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        elif not self.shared:
+            # msvcrt has no shared locks, so those are not taken there, and its blocking mode gives up after 10 s
+            import msvcrt
+            while True:
+                try:
+                    self.file.seek(0)
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+    def release(self):
+        # Closing the file drops the lock
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def claim_path(claims_folder, original):
+    return os.path.join(claims_folder, hashlib.blake2b(os.fsencode(original), digest_size=16).hexdigest() + ".claim")
+
+
+def process_alive(pid):
+    if os.name == "nt":
+        # os.kill would terminate the process, so ask for its exit code instead
+        import ctypes
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            # ERROR_ACCESS_DENIED: the pid belongs to a process of another user
+            return ctypes.get_last_error() == 5
+        try:
+            code = ctypes.c_ulong()
+            return not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)) or code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def claim_is_stale(path):
+    try:
+        age = time.time() - os.stat(path).st_mtime
+        with open(path) as claim:
+            host, pid = claim.read().split()
+    except FileNotFoundError:
+        return True
+    except ValueError:
+        # The owner has created the claim but not written it yet, or died in between
+        return age > CLAIM_STALE_SECONDS
+    if host == socket.gethostname() and not process_alive(int(pid)):
+        return True
+    return age > CLAIM_STALE_SECONDS
+
+
+def claim_owner(path):
+    # "<host> <pid>" of the builder holding a claim, for messages
+    try:
+        with open(path) as claim:
+            return claim.read().strip() or "unknown builder"
+    except FileNotFoundError:
+        return "released"
+
+
+def try_claim(path):
+    # Exclusive creation is atomic on local disks and NFSv3+, so one builder wins each original.
+    # Two builders taking over the same stale claim at once can both win; that costs a thumbnail
+    # made twice, and atomic writes keep it from costing more.
+    for _ in range(2):
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not claim_is_stale(path):
+                return False
+            release_claim(path)
+            continue
+        with os.fdopen(descriptor, "w") as claim:
+            claim.write(f"{socket.gethostname()} {os.getpid()}")
+        return True
+    return False
+
+
+def release_claim(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def claim_batch(claims_folder, batch):
+    # Splits (path, size, mtime_ns) entries into the ones claimed and the ones another builder holds
+    claimed = []
+    busy = []
+    for entry in batch:
+        (claimed if try_claim(claim_path(claims_folder, entry[0])) else busy).append(entry)
+    return claimed, busy
+
+
+def release_batch(claims_folder, batch):
+    for entry in batch:
+        release_claim(claim_path(claims_folder, entry[0]))
+
+
+def describe_claims(claims_folder, entries):
+    # One line per builder holding claims on the (path, size, mtime_ns) entries
+    owners = collections.defaultdict(list)
+    for entry in entries:
+        path = claim_path(claims_folder, entry[0])
+        owners[claim_owner(path)].append(path)
+    return [f"  {len(paths)} held by {owner}, e.g. {paths[0]}" for owner, paths in owners.items()]
+
+
+CacheChanges = collections.namedtuple("CacheChanges", ["added", "changed", "removed"])
+
+
+class CacheIndex:
+    # SQLite index of the thumbnail cache, keyed by original path, size and mtime
+    FILE_NAME = "index.sqlite"
+
+    def __init__(self, cache_folder):
+        os.makedirs(cache_folder, exist_ok=True)
+        self.path = os.path.join(cache_folder, self.FILE_NAME)
+        # Builders sharing the cache take turns writing under writing(). WAL needs shared memory
+        # that network file systems do not provide, so the index keeps a rollback journal.
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        with self.writing():
+            self.conn.execute("PRAGMA journal_mode=DELETE")
+            self.migrate()
+
+    def migrate(self):
+        # Only one process migrates an older index
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                original TEXT PRIMARY KEY,
+                resized TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            )
+        """)
+        # Columns added after the first release; rows from older caches get rebuilt through CACHE_VERSION
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(images)")}
+        for column, definition in (("zoom", "TEXT"), ("preview", "TEXT"), ("version", "INTEGER NOT NULL DEFAULT 0"), ("animation", "TEXT"), ("folder", "TEXT"), ("hash", "TEXT"),
+                                   ("width", "INTEGER"), ("height", "INTEGER"), ("format", "TEXT"), ("frames", "INTEGER"), ("taken", "TEXT")):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE images ADD COLUMN {column} {definition}")
+        # The folder of every original lets the watcher diff one folder without reading the whole index
+        self.conn.executemany("UPDATE images SET folder = ? WHERE original = ?",
+                              [(os.path.dirname(original), original) for original, in
+                               self.conn.execute("SELECT original FROM images WHERE folder IS NULL").fetchall()])
+        self.conn.execute("CREATE INDEX IF NOT EXISTS images_folder ON images (folder)")
+        # Originals that could not be read, so updates do not decode them again until they change
+        self.conn.execute("CREATE TABLE IF NOT EXISTS failed (original TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, version INTEGER NOT NULL, folder TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS failed_folder ON failed (folder)")
+        self.conn.commit()
+
+    def writing(self):
+        return FileLock(self.path + ".lock", shared=False)
+
+    def close(self):
+        self.conn.close()
+
+    def diff(self, original_folder, folders=None, retry_failed=True):
+        # Stat-only comparison of the folder against the index; nothing is decoded. Given folders,
+        # only the images directly inside them are compared, as the folder watcher needs. Unless
+        # retry_failed, originals that failed before are left out until their size or mtime changes.
+        query = "SELECT original, size, mtime_ns, version FROM images"
+        failed_query = "SELECT original, size, mtime_ns, version FROM failed"
+        if folders is None:
+            rows = self.conn.execute(query)
+            failed_rows = self.conn.execute(failed_query).fetchall()
+            found = scan_image_files(os.path.abspath(original_folder))
         else:
-            return QSize(int(label_size.height() * aspect_ratio), label_size.height())
-
-    def enterEvent(self, event):
-        if not self.hovered:
-            self.hovered = True
-            self.animation.stop()
-            self.animation.setStartValue(1.0)
-            self.animation.setEndValue(1.1)
-            self.animation.start()
-            self.parent_widget.reset_hover_states(self)
-            self.parent_widget.show_large_image(self.original_path, self)
-            self.parent_widget.show_notification(self.original_path, self)
-
-    def leaveEvent(self, event):
-        if self.hovered and not self.toggled:
-            self.hovered = False
-            self.animation.stop()
-            self.animation.setStartValue(1.1)
-            self.animation.setEndValue(1.0)
-            self.animation.start()
-
-    def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            self.toggled = not self.toggled
-            self.update()
-
-    def paintEvent(self, event):
-        super().paintEvent(event)
-        if self.toggled:
-            painter = QPainter(self)
-            painter.setPen(QColor(255, 255, 0))
-            if self.pixmap() is not None:
-                rect = self.pixmap().rect()
-                rect.moveCenter(self.rect().center())
-                painter.drawRect(rect.adjusted(0, 0, -1, -1))
-
-    def resizeEvent(self, event):
-        self.update()
-
-    def setPixmap(self, pixmap):
-        super().setPixmap(pixmap)
-        self.update()
-
-    def update(self):
-        super().update()
-        self.repaint()
-
-
-class NotificationBox(QWidget):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
-        self.setAttribute(Qt.WA_TranslucentBackground)
-        self.setStyleSheet("background-color: rgba(0, 0, 0, 150); color: white; border-radius: 10px; padding: 10px;")
-        self.label = QLabel(self)
-        layout = QVBoxLayout(self)
-        layout.addWidget(self.label)
-        self.setLayout(layout)
-        self.animation = QPropertyAnimation(self, b"windowOpacity")
-        self.animation.setDuration(1000)
-        self.animation.setStartValue(1.0)
-        self.animation.setEndValue(0.0)
-        self.timer = QTimer(self)
-        self.timer.setInterval(2000)
-        self.timer.timeout.connect(self.hide_notification)
-
-    def show_notification(self, text, position):
-        self.label.setText(text)
-        self.adjustSize()
-        if position == 'left':
-            self.move(self.parent().width() - self.width() - 20, 20)
+            folders = [os.path.abspath(folder) for folder in folders]
+            rows = itertools.chain.from_iterable(self.conn.execute(query + " WHERE folder = ?", (folder,)) for folder in folders)
+            failed_rows = [row for folder in folders for row in self.conn.execute(failed_query + " WHERE folder = ?", (folder,))]
+            found = itertools.chain.from_iterable(scan_image_files(folder, recursive=False) for folder in folders)
+        known = {original: (size, mtime_ns, version) for original, size, mtime_ns, version in rows}
+        known_failed = {original: (size, mtime_ns, version) for original, size, mtime_ns, version in failed_rows}
+        added = []
+        changed = []
+        for path, size, mtime_ns in found:
+            stat = known.pop(path, None)
+            if known_failed.pop(path, None) == (size, mtime_ns, cache_version(path)) and not retry_failed:
+                # An indexed original rewritten unreadably keeps its old thumbnails meanwhile
+                continue
+            if stat is None:
+                added.append((path, size, mtime_ns))
+            elif stat != (size, mtime_ns, cache_version(path)):
+                changed.append((path, size, mtime_ns))
+        if known_failed:
+            # Failed originals that are gone, or inside a folder that is not scanned by a full update
+            self.forget_failed([path for path in known_failed if folders is not None or path.startswith(os.path.join(os.path.abspath(original_folder), ""))])
+        return CacheChanges(added, changed, sorted(known))
+
+    def put(self, entries):
+        # entries are (original, levels, size, mtime_ns) rows as returned by process_batch. Returns the
+        # thumbnails of the replaced rows that the new ones no longer use, as those of an older cache
+        # layout, so the caller can delete them.
+        replaced = []
+        with self.writing():
+            for original, levels, size, mtime_ns in entries:
+                row = self.conn.execute(f"SELECT {', '.join(LEVEL_NAMES)} FROM images WHERE original = ?", (original,)).fetchone()
+                if row:
+                    replaced.extend(path for path in row if path and path not in levels.values())
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO images (original, {', '.join(LEVEL_NAMES + METADATA_FIELDS)}, size, mtime_ns, version, folder, hash) "
+                f"VALUES ({', '.join('?' * (len(LEVEL_NAMES) + len(METADATA_FIELDS) + 6))})",
+                [(original, *(levels[name] for name in LEVEL_NAMES), *(levels.get(name) for name in METADATA_FIELDS),
+                  size, mtime_ns, cache_version(original), os.path.dirname(original), levels.get("hash"))
+                 for original, levels, size, mtime_ns in entries])
+            self.conn.executemany("DELETE FROM failed WHERE original = ?", [(entry[0],) for entry in entries])
+            self.conn.commit()
+        return replaced
+
+    def put_failed(self, files):
+        # files are the (path, size, mtime_ns) entries of originals that could not be read
+        with self.writing():
+            self.conn.executemany("INSERT OR REPLACE INTO failed (original, size, mtime_ns, version, folder) VALUES (?, ?, ?, ?, ?)",
+                                  [(path, size, mtime_ns, cache_version(path), os.path.dirname(path)) for path, size, mtime_ns in files])
+            self.conn.commit()
+
+    def forget_failed(self, originals):
+        if originals:
+            with self.writing():
+                self.conn.executemany("DELETE FROM failed WHERE original = ?", [(original,) for original in originals])
+                self.conn.commit()
+
+    def missing_metadata(self):
+        # Rows indexed before metadata was recorded
+        return [original for original, in self.conn.execute("SELECT original FROM images WHERE width IS NULL")]
+
+    def put_metadata(self, entries):
+        # entries are (original, metadata) pairs as returned by read_metadata_batch
+        with self.writing():
+            self.conn.executemany(f"UPDATE images SET {', '.join(f'{name} = ?' for name in METADATA_FIELDS)} WHERE original = ?",
+                                  [(*(metadata[name] for name in METADATA_FIELDS), original) for original, metadata in entries])
+            self.conn.commit()
+
+    def remove(self, originals):
+        # Returns the stored thumbnails of every level so the caller can delete them
+        removed = []
+        for original in originals:
+            row = self.conn.execute(f"SELECT {', '.join(LEVEL_NAMES)} FROM images WHERE original = ?", (original,)).fetchone()
+            if row:
+                removed.extend(path for path in row if path)
+        with self.writing():
+            self.conn.executemany("DELETE FROM images WHERE original = ?", [(original,) for original in originals])
+            self.conn.commit()
+        return removed
+
+    def covers(self, original_folder):
+        # Whether any indexed original lies inside original_folder
+        prefix = os.path.join(os.path.abspath(original_folder), "")
+        return self.conn.execute("SELECT 1 FROM images WHERE original > ? AND original < ? LIMIT 1",
+                                 (prefix, prefix + "\U0010ffff")).fetchone() is not None
+
+    def entries(self, originals=None):
+        fields = ("original",) + LEVEL_NAMES + METADATA_FIELDS + ("size", "mtime_ns")
+        query = f"SELECT {', '.join(fields)} FROM images"
+        if originals is None:
+            rows = self.conn.execute(query + " ORDER BY original")
         else:
-            self.move(20, 20)
-        self.show()
-        self.animation.start()
-        self.timer.start()
-
-    def hide_notification(self):
-        self.timer.stop()
-        self.hide()
-
-class CopyDialog(QDialog):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Copy Selected Images")
-        self.setGeometry(100, 100, 300, 150)
-        layout = QVBoxLayout(self)
-        self.checkbox = QCheckBox("Use thumbnails instead for this copy", self)
-        layout.addWidget(self.checkbox)
-        self.button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
-        layout.addWidget(self.button_box)
-        self.button_box.accepted.connect(self.accept)
-        self.button_box.rejected.connect(self.reject)
-
-class ImageGallery(QMainWindow):
-    def __init__(self):
-        super().__init__()
-        self.setWindowTitle("Image Gallery")
-        self.scroll_area = QScrollArea(self)
-        self.scroll_area.setWidgetResizable(True)
-        self.widget = QWidget()
-        self.layout = QGridLayout(self.widget)
-        self.widget.setLayout(self.layout)
-        self.scroll_area.setWidget(self.widget)
-        self.setCentralWidget(self.scroll_area)
-        self.images = []
-        self.image_data = []
-        self.scroll_area.viewport().installEventFilter(self)
-        self.notification_box = NotificationBox(self)
-        self.large_image_label = QLabel(self)
-        self.large_image_label.setStyleSheet("""
-            background-color: rgba(0, 0, 0, 150);
-            border: 2px solid white;
-            border-radius: 10px;
-            padding: 10px;
+            rows = itertools.chain.from_iterable(self.conn.execute(query + " WHERE original = ?", (original,)) for original in originals)
+        return [dict(zip(fields, row)) for row in rows]
+
+    def current(self, files):
+        # The originals among (path, size, mtime_ns) entries whose thumbnails are indexed and up to date,
+        # such as the ones another builder made after this one's diff
+        return {path for path, size, mtime_ns in files if self.conn.execute(
+            "SELECT 1 FROM images WHERE original = ? AND size = ? AND mtime_ns = ? AND version = ?",
+            (path, size, mtime_ns, cache_version(path))).fetchone()}
+
+
+class ContentStore:
+    # Thumbnails shared by every library, filed under a hash of the original's contents so
+    # duplicates and copies are made once. Known (path, size, mtime) hashes are kept so an
+    # unchanged file is never hashed twice. Libraries register their index, and gc() deletes
+    # the objects that no registered index refers to any more.
+    FILE_NAME = "store.sqlite"
+    shared = {}
+
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+        os.makedirs(self.folder, exist_ok=True)
+        # A rollback journal with writes serialised under writing(), as in CacheIndex
+        self.conn = sqlite3.connect(os.path.join(self.folder, self.FILE_NAME), timeout=60)
+        with self.writing():
+            self.conn.execute("PRAGMA journal_mode=DELETE")
+            self.migrate()
+        # Objects this worker already made or found, so duplicates within a run skip the lookup
+        self.made = {}
+
+    def migrate(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS objects (
+                hash TEXT PRIMARY KEY,
+                {', '.join(f'{name} TEXT' for name in LEVEL_NAMES)},
+                version INTEGER NOT NULL
+            )
         """)
-        self.large_image_label.hide()
-        self.create_menu()
-        
-        # Existing initialization code...
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_visible_gifs)
-        self.timer.start(1000)  # Update every second
-
-    def update_visible_gifs(self):
-        viewport_rect = self.scroll_area.viewport().rect()
-        for label in self.images:
-            label_rect = self.scroll_area.viewport().mapFromGlobal(label.mapToGlobal(label.rect().topLeft()))
-            if viewport_rect.intersects(QRect(label_rect, label.size())):
-                if isinstance(label, AnimatedLabel) and label.movie:
-                    label.movie.start()
+        # Metadata describes the contents, so duplicates found in the store get it too
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(objects)")}
+        for column in METADATA_FIELDS:
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE objects ADD COLUMN {column}")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS libraries (index_path TEXT PRIMARY KEY)")
+        self.conn.commit()
+
+    def writing(self):
+        return FileLock(os.path.join(self.folder, self.FILE_NAME + ".lock"), shared=False)
+
+    @classmethod
+    def open_shared(cls, folder):
+        # One connection per worker process, kept open across batches
+        store = cls.shared.get(folder)
+        if store is None:
+            store = cls.shared[folder] = cls(folder)
+        return store
+
+    def close(self):
+        self.conn.close()
+
+    def known_hash(self, path, size, mtime_ns):
+        row = self.conn.execute("SELECT hash FROM hashes WHERE path = ? AND size = ? AND mtime_ns = ?", (path, size, mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, digest, version):
+        fields = LEVEL_NAMES + METADATA_FIELDS
+        row = self.conn.execute(f"SELECT {', '.join(fields)} FROM objects WHERE hash = ? AND version = ?", (digest, version)).fetchone()
+        if row is None or not os.path.exists(row[0]):
+            return None
+        return dict(zip(fields, row))
+
+    def level_paths(self, digest, file_path):
+        # <store>/<level folder>/<first two hex digits>/<hash><extension of the original>
+        ext = os.path.splitext(file_path)[1].lower()
+        return {name: os.path.join(self.folder, folder, digest[:2], digest + ext) for name, folder in LEVEL_FOLDERS.items()}
+
+    def put(self, entries):
+        # entries are index rows whose levels carry the "hash" of the original; their objects
+        # were stored by the workers that made them
+        with self.writing():
+            self.conn.executemany("INSERT OR REPLACE INTO hashes (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                                  [(original, size, mtime_ns, levels["hash"]) for original, levels, size, mtime_ns in entries])
+            self.conn.commit()
+
+    def put_object(self, digest, levels, version):
+        with self.writing():
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO objects (hash, {', '.join(LEVEL_NAMES + METADATA_FIELDS)}, version) "
+                f"VALUES ({', '.join('?' * (len(LEVEL_NAMES) + len(METADATA_FIELDS) + 2))})",
+                (digest, *(levels[name] for name in LEVEL_NAMES), *(levels.get(name) for name in METADATA_FIELDS), version))
+            self.conn.commit()
+
+    def make(self, digest, file_path, options):
+        # Every builder sharing the store claims an object before making it. The object is stored
+        # before the claim is released, so a builder that finds it claimed waits and then uses it.
+        version = cache_version(file_path)
+        claim = os.path.join(self.folder, "claims", digest + ".claim")
+        os.makedirs(os.path.dirname(claim), exist_ok=True)
+        deadline = time.monotonic() + CLAIM_WAIT_SECONDS
+        while not try_claim(claim):
+            if time.monotonic() > deadline:
+                raise OSError(f"still being made by {claim_owner(claim)} after {CLAIM_WAIT_SECONDS} s, see {claim}")
+            time.sleep(CLAIM_RETRY_SECONDS / 10)
+            levels = self.lookup(digest, version)
+            if levels is not None:
+                return levels
+        try:
+            # Made by another builder between the caller's lookup and the claim
+            levels = self.lookup(digest, version)
+            if levels is None:
+                levels = resize_image(file_path, self.level_paths(digest, file_path), options)
+                self.put_object(digest, levels, version)
+            return levels
+        finally:
+            release_claim(claim)
+
+    def register(self, index_path):
+        with self.writing():
+            self.conn.execute("INSERT OR IGNORE INTO libraries (index_path) VALUES (?)", (os.path.abspath(index_path),))
+            self.conn.commit()
+
+    def lock(self, shared=True):
+        # Builders hold it shared for a whole update, so gc never sweeps an object that is made
+        # but not indexed yet
+        return FileLock(os.path.join(self.folder, "store.lock"), shared)
+
+    def gc(self):
+        with self.lock(shared=False), self.writing():
+            return self.sweep()
+
+    def sweep(self):
+        # Mark the hashes of every registered library that still exists, then sweep the rest.
+        # Returns the number of objects removed.
+        referenced = set()
+        for index_path, in self.conn.execute("SELECT index_path FROM libraries").fetchall():
+            if not os.path.exists(index_path):
+                self.conn.execute("DELETE FROM libraries WHERE index_path = ?", (index_path,))
+                continue
+            library = sqlite3.connect(index_path, timeout=60)
+            try:
+                referenced.update(digest for digest, in library.execute("SELECT DISTINCT hash FROM images WHERE hash IS NOT NULL"))
+            finally:
+                library.close()
+        unused = [row for row in self.conn.execute(f"SELECT hash, {', '.join(LEVEL_NAMES)} FROM objects").fetchall() if row[0] not in referenced]
+        for digest, *paths in unused:
+            for path in paths:
+                if path and os.path.exists(path):
+                    os.remove(path)
+        self.conn.executemany("DELETE FROM objects WHERE hash = ?", [(row[0],) for row in unused])
+        self.conn.execute("DELETE FROM hashes WHERE hash NOT IN (SELECT hash FROM objects)")
+        self.conn.commit()
+        return len(unused)
+
+
+PackedThumbnail = collections.namedtuple("PackedThumbnail", ["width", "height", "data"])
+
+
+class PackStore:
+    # Append-only pack files of raw RGBA thumbnails. Entries are addressed by
+    # "pack:<pack file>#<offset>" locators stored in the index instead of a file path.
+    HEADER = struct.Struct("<4sII")
+    MAGIC = b"GTPK"
+    PREFIX = "pack:"
+
+    def __init__(self, cache_folder, max_bytes=PACK_FILE_BYTES):
+        self.folder = os.path.join(os.path.abspath(cache_folder), "packs")
+        self.max_bytes = max_bytes
+        os.makedirs(self.folder, exist_ok=True)
+        packs = sorted(name for name in os.listdir(self.folder) if name.startswith("pack-") and name.endswith(".bin"))
+        self.number = int(packs[-1][5:-4]) if packs else 0
+        self.file = None
+
+    def pack_path(self, number):
+        return os.path.join(self.folder, f"pack-{number:05d}.bin")
+
+    def append(self, thumbnail):
+        if self.file is None:
+            self.file = open(self.pack_path(self.number), "ab")
+        offset = self.file.seek(0, os.SEEK_END)
+        if offset and offset + self.HEADER.size + len(thumbnail.data) > self.max_bytes:
+            self.file.close()
+            self.number += 1
+            self.file = open(self.pack_path(self.number), "ab")
+            offset = 0
+        self.file.write(self.HEADER.pack(self.MAGIC, thumbnail.width, thumbnail.height))
+        self.file.write(thumbnail.data)
+        return f"{self.PREFIX}{self.file.name}#{offset}"
+
+    def store_rows(self, rows):
+        # Builders sharing the cache append under the pack folder's lock, so their entries never
+        # interleave. The data is on disk before the lock is released and the index points at it.
+        with FileLock(os.path.join(self.folder, "packs.lock")):
+            rows = [self.store_row(row) for row in rows]
+            self.flush()
+        return rows
+
+    def store_row(self, row):
+        # Swaps the PackedThumbnail levels of an index row for their locators
+        original, levels, size, mtime_ns = row
+        levels = {name: self.append(level) if isinstance(level, PackedThumbnail) else level for name, level in levels.items()}
+        return original, levels, size, mtime_ns
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    @classmethod
+    def is_locator(cls, resized):
+        return resized.startswith(cls.PREFIX)
+
+    @classmethod
+    def parse_locator(cls, locator):
+        path, offset = locator[len(cls.PREFIX):].rsplit("#", 1)
+        return path, int(offset)
+
+    @classmethod
+    def read_image(cls, locator):
+        # Plain file read for exports; the GUI maps packs instead
+        path, offset = cls.parse_locator(locator)
+        with open(path, "rb") as pack:
+            pack.seek(offset)
+            magic, width, height = cls.HEADER.unpack(pack.read(cls.HEADER.size))
+            if magic != cls.MAGIC:
+                raise OSError(f"Corrupt pack entry {locator}")
+            return Image.frombytes("RGBA", (width, height), pack.read(width * height * 4))
+
+
+def delete_thumbnails(paths):
+    # Removed pack entries simply become dead space in their pack file
+    for path in paths:
+        if not PackStore.is_locator(path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another builder removed it first
+                pass
+
+
+# skipped are the originals left to other builders that never finished them
+CacheResult = collections.namedtuple("CacheResult", ["index_path", "done", "failed", "skipped"], defaults=[()])
+
+
+def update_cache(original_folder, cache_resized_folder, workers=None, batch_size=DEFAULT_BATCH_SIZE, on_removed=None, on_batch=None, is_cancelled=None, options=DEFAULT_CACHE_OPTIONS, on_progress=None, folders=None, report_unchanged=True, on_metadata=None, claim_wait=CLAIM_WAIT_SECONDS, retry_failed=True):
+    # on_removed gets the originals dropped from the index, on_batch the entries of every finished batch
+    # and on_progress (done, failed, total) after every batch. Only what is missing from the index is
+    # made, so rerunning after an interrupted run resumes it. folders limits the update to the images
+    # directly inside those folders; watched updates that found nothing to do stay quiet. A full update
+    # also reads the metadata of rows indexed before it was recorded and passes them to on_metadata.
+    # Several builders, on one machine or several, can update the same cache at once: each original
+    # is claimed by one of them, and the others pick up its index row once it is made. When claim_wait
+    # seconds pass without any of the claimed originals getting done, the rest are skipped.
+    # Originals that failed are recorded; unless retry_failed, they are not tried again until they change.
+    original_folder = os.path.abspath(original_folder)
+    index = CacheIndex(cache_resized_folder)
+    pack = PackStore(cache_resized_folder) if options.cache_format == "pack" else None
+    store = ContentStore(options.content_store) if options.content_store else None
+    store_lock = store.lock() if store is not None else None
+    if store is not None:
+        store_lock.acquire()
+        store.register(index.path)
+    claims_folder = os.path.join(os.path.abspath(cache_resized_folder), "claims")
+    os.makedirs(claims_folder, exist_ok=True)
+    running = {}
+    try:
+        changes = index.diff(original_folder, folders, retry_failed)
+        removed = index.remove(changes.removed)
+        # Stored objects may be shared with other libraries, so ContentStore.gc removes those
+        if store is None:
+            delete_thumbnails(removed)
+        if on_removed and changes.removed:
+            on_removed(changes.removed)
+        pending = changes.added + changes.changed
+        done = 0
+        made_elsewhere = 0
+        failed = []
+        skipped = []
+        report = report_unchanged or pending or changes.removed
+        if report:
+            print(f"{len(changes.added)} new, {len(changes.changed)} changed, {len(changes.removed)} removed images")
+        if pending:
+            # No more processes than batches, as a watched update of a few files would start one per CPU
+            workers = min(workers or os.cpu_count() or 1, -(-len(pending) // batch_size))
+            cancelled = False
+            # Decoding and resampling are CPU bound, so spread batches over processes instead of threads
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=ignore_interrupts) as executor:
+                try:
+                    remaining = pending
+                    waiting_since = None
+                    while remaining:
+                        batches = iter_batches(remaining, batch_size)
+                        busy = []
+                        while True:
+                            # Batches are claimed as they are submitted; a couple per worker keeps the
+                            # workers busy while few claims are held and none of them for long
+                            while not cancelled and len(running) < workers * 2:
+                                batch = next(batches, None)
+                                if batch is None:
+                                    break
+                                batch, batch_busy = claim_batch(claims_folder, batch)
+                                busy.extend(batch_busy)
+                                finished = index.current(batch)
+                                if finished:
+                                    release_batch(claims_folder, [entry for entry in batch if entry[0] in finished])
+                                    batch = [entry for entry in batch if entry[0] not in finished]
+                                    made_elsewhere += len(finished)
+                                    if on_batch:
+                                        on_batch(index.entries(finished))
+                                if batch:
+                                    future = executor.submit(process_batch, batch, original_folder, cache_resized_folder, options, metrics.config())
+                                    running[future] = batch
+                            if not running:
+                                break
+                            completed, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                            for future in completed:
+                                batch = running.pop(future)
+                                if future.cancelled():
+                                    release_batch(claims_folder, batch)
+                                    continue
+                                # Committing per batch keeps finished work if the run is interrupted
+                                try:
+                                    rows, batch_failed, batch_metrics = future.result()
+                                    metrics.merge(batch_metrics)
+                                    with metrics.timer("index"):
+                                        if pack is not None:
+                                            rows = pack.store_rows(rows)
+                                        if store is not None:
+                                            store.put(rows)
+                                        replaced = index.put(rows)
+                                        if store is None:
+                                            delete_thumbnails(replaced)
+                                        if batch_failed:
+                                            index.put_failed([entry for entry in batch if entry[0] in batch_failed])
+                                finally:
+                                    release_batch(claims_folder, batch)
+                                done += len(rows)
+                                failed.extend(batch_failed)
+                                if on_batch and rows:
+                                    on_batch([dict(levels, original=original, size=size, mtime_ns=mtime_ns) for original, levels, size, mtime_ns in rows])
+                                if on_progress:
+                                    on_progress(done + made_elsewhere, len(failed), len(pending))
+                            if not cancelled and is_cancelled and is_cancelled():
+                                cancelled = True
+                                for future in running:
+                                    future.cancel()
+                        if cancelled or not busy or (is_cancelled and is_cancelled()):
+                            break
+                        # Other builders hold the rest; wait for their rows, or take over claims they abandoned,
+                        # for as long as some of them keep getting done
+                        if waiting_since is None:
+                            print(f"Waiting for {len(busy)} images claimed by other builds:")
+                            print("\n".join(describe_claims(claims_folder, busy)))
+                        if waiting_since is None or len(busy) < len(remaining):
+                            waiting_since = time.monotonic()
+                        elif time.monotonic() - waiting_since > claim_wait:
+                            skipped = [entry[0] for entry in busy]
+                            print(f"Skipped {len(skipped)} images whose claims were not released within {claim_wait} s:")
+                            print("\n".join(describe_claims(claims_folder, busy)))
+                            print(f"Run again once those builds are done, or delete their claims in {claims_folder} if they are gone")
+                            break
+                        time.sleep(CLAIM_RETRY_SECONDS)
+                        remaining = busy
+                except KeyboardInterrupt:
+                    # Leaving the with block waits for the batches already running; the queued ones are dropped
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+        missing = [] if folders is not None or (is_cancelled and is_cancelled()) else index.missing_metadata()
+        if missing:
+            print(f"Reading metadata of {len(missing)} images indexed without it")
+            metadata_workers = min(workers or os.cpu_count() or 1, -(-len(missing) // batch_size))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=metadata_workers, initializer=ignore_interrupts) as executor:
+                futures = [executor.submit(read_metadata_batch, batch) for batch in iter_batches(missing, batch_size)]
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        rows = future.result()
+                        index.put_metadata(rows)
+                        if on_metadata and rows:
+                            on_metadata([dict(metadata, original=original) for original, metadata in rows])
+                        if is_cancelled and is_cancelled():
+                            executor.shutdown(wait=True, cancel_futures=True)
+                            break
+                except KeyboardInterrupt:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+    finally:
+        for batch in running.values():
+            release_batch(claims_folder, batch)
+        if pack is not None:
+            pack.close()
+        if store is not None:
+            store.close()
+            store_lock.release()
+        index.close()
+    if pending:
+        elsewhere = f", {made_elsewhere} made by another build" if made_elsewhere else ""
+        left = f", {len(skipped)} skipped" if skipped else ""
+        print(f"Made thumbnails for {done} of {len(pending)} images, {len(failed)} failed{elsewhere}{left}")
+    if report:
+        print(f"Cache index saved at {index.path}")
+    return CacheResult(index.path, done, failed, skipped)
+
+
+COPY_WORKERS = 4
+COPY_CHUNK_BYTES = 16 * 1024 * 1024  # Cancelling waits for at most one chunk per copy
+# FAT and some network shares keep coarse modification times
+COPY_MTIME_TOLERANCE_NS = 2 * 1000 * 1000 * 1000
+FICLONE = 0x40049409  # Linux ioctl that shares the source's blocks (btrfs, XFS, bcachefs)
+
+CopyResult = collections.namedtuple("CopyResult", ["copied", "skipped", "failed", "cancelled"])
+
+
+class CopyCancelled(Exception):
+    pass
+
+
+def is_same_file(source_stat, destination):
+    # Same size and modification time counts as identical; copies keep the source's mtime
+    try:
+        stat = os.stat(destination)
+    except OSError:
+        return False
+    return stat.st_size == source_stat.st_size and abs(stat.st_mtime_ns - source_stat.st_mtime_ns) <= COPY_MTIME_TOLERANCE_NS
+
+
+def clone_file(source, destination):
+    # A reflink copies nothing until either file is changed; False where the file system cannot
+    try:
+        import fcntl
+        fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def copy_data(source, destination, size, is_cancelled=None, on_bytes=None):
+    # Kernel side copies first: copy_file_range (Linux, server-side on NFS 4.2 and SMB3), then
+    # sendfile (Linux, also across file systems), then plain reads and writes
+    copied = 0
+    methods = [method for method in ("copy_file_range", "sendfile") if hasattr(os, method) and sys.platform.startswith("linux")]
+    while copied < size:
+        if is_cancelled and is_cancelled():
+            raise CopyCancelled()
+        count = min(COPY_CHUNK_BYTES, size - copied)
+        try:
+            if methods and methods[0] == "copy_file_range":
+                sent = os.copy_file_range(source.fileno(), destination.fileno(), count, copied, copied)
+            elif methods:
+                destination.seek(copied)
+                sent = os.sendfile(destination.fileno(), source.fileno(), copied, count)
             else:
-                if isinstance(label, AnimatedLabel) and label.movie:
-                    label.movie.stop()
-
-    def create_menu(self):
-        menubar = self.menuBar()
-        edit_menu = menubar.addMenu("Edit")
-        clear_action = QAction("Clear Toggles", self)
-        clear_action.triggered.connect(self.clear_toggles)
-        edit_menu.addAction(clear_action)
-        copy_action = QAction("Copy Selected to", self)
-        copy_action.triggered.connect(self.copy_selected_to)
-        edit_menu.addAction(copy_action)
-
-    def clear_toggles(self):
-        for label in self.images:
-            if label.toggled:
-                label.toggled = False
-                label.update()
-
-    def copy_selected_to(self):
-        dialog = CopyDialog(self)
-        if dialog.exec_() == QDialog.Accepted:
-            use_thumbnails = dialog.checkbox.isChecked()
-            folder = QFileDialog.getExistingDirectory(self, "Select Folder")
-            if folder:
-                for label in self.images:
-                    if label.toggled:
-                        src = label.original_path if not use_thumbnails else label.original_pixmap
-                        dst = os.path.join(folder, os.path.basename(label.original_path))
-                        if use_thumbnails:
-                            label.pixmap().save(dst)
-                        else:
-                            shutil.copy2(src, dst)
-                QMessageBox.information(self, "Copy Completed", "Selected images have been copied successfully.")
-
-    def load_json(self, json_path):
-        with open(json_path, "r") as file:
-            data = json.load(file)
-            self.image_data = data
-            self.display_images()
-
-    def display_images(self):
-        if not self.image_data:
-            QMessageBox.warning(self, "No Images Found", "No images were found in the selected folder.")
-            return
-        for item in self.image_data:
-            img_path = item["resized"]
-            if img_path.lower().endswith('.gif'):
-                movie = QMovie(img_path)
-                label = AnimatedLabel(QPixmap(), item["original"], self)
-                label.setMovie(movie)
-                movie.start()
+                source.seek(copied)
+                destination.seek(copied)
+                sent = destination.write(source.read(min(count, 1024 * 1024)))
+        except OSError:
+            if not methods:
+                raise
+            # Not supported between these files (EXDEV, EINVAL, ENOSYS); try the next way
+            methods.pop(0)
+            continue
+        if not sent:
+            if not methods:
+                break  # The source shrank while being copied
+            # Some file systems report 0 instead of an error for copies they do not handle; the
+            # next way finds out whether the source really ends here
+            methods.pop(0)
+            continue
+        copied += sent
+        if on_bytes:
+            on_bytes(sent)
+    return copied
+
+
+def copy_file(source, destination, is_cancelled=None, on_bytes=None):
+    # Copies data and metadata like shutil.copy2 through a .part file, so a cancelled or failed
+    # copy never leaves a truncated file. Returns False when an identical file was already there.
+    source_stat = os.stat(source)
+    if is_same_file(source_stat, destination):
+        if on_bytes:
+            on_bytes(source_stat.st_size)
+        return False
+    partial = destination + ".part"
+    try:
+        with open(source, "rb", buffering=0) as source_file, open(partial, "wb", buffering=0) as destination_file:
+            if clone_file(source_file, destination_file):
+                if on_bytes:
+                    on_bytes(source_stat.st_size)
             else:
-                img = Image.open(img_path)
-                img.thumbnail((150, 150))  # Resize the image to fit within 150x150 pixels
-                img = img.convert("RGBA")
-                data = img.tobytes("raw", "RGBA")
-                qimg = QImage(data, img.width, img.height, QImage.Format_RGBA8888)
-                pixmap = QPixmap.fromImage(qimg)
-                label = AnimatedLabel(pixmap, item["original"], self)
-            label.setAlignment(Qt.AlignCenter)  # Center the image
-            label.setVisible(False)
-            self.images.append(label)
-        self.reposition_images()
-
-    def reposition_images(self):
-        width = self.scroll_area.viewport().width()
-        columns = max(1, width // 250)  # Adjust the column width to reduce padding
-        row_heights = [0] * ((len(self.images) + columns - 1) // columns)  # Track the height of each row
-        padding = 200  *columns # Add padding between rows
-        for index, label in enumerate(self.images):
-            row = index // columns
-            column = index % columns
-            self.layout.addWidget(label, row, column, Qt.AlignCenter)  # Center the images within the grid
-            row_heights[row] = max(row_heights[row], label.sizeHint().height() + padding)
-        for row in range(len(row_heights)):
-            self.layout.setRowMinimumHeight(row, row_heights[row])  # Set the minimum height for each row
-        self.widget.setMinimumHeight(sum(row_heights))  # Set the widget's height to the sum of row heights
-        self.lazy_load_images()
-        self.widget.updateGeometry()  # Trigger a layout update
-
-
-    def lazy_load_images(self):
-        viewport_rect = self.scroll_area.viewport().rect()
-        for label in self.images:
-            if label.isVisible():
-                continue
-            label_rect = self.scroll_area.viewport().mapFromGlobal(label.mapToGlobal(label.rect().topLeft()))
-            if viewport_rect.intersects(QRect(label_rect, label.size())):
-                label.setVisible(True)
-                if isinstance(label, AnimatedLabel) and label.movie:
-                    label.movie.start()
-
-
-
-
-    def reset_hover_states(self, current_label):
-        for label in self.images:
-            if label != current_label and label.hovered:
-                label.hovered = False
-                label.animation.stop()
-                label.animation.setStartValue(1.1)
-                label.animation.setEndValue(1.0)
-                label.animation.start()
-
-    def eventFilter(self, source, event):
-        if event.type() == QEvent.Resize and source is self.scroll_area.viewport():
-            self.reposition_images()
-            self.update_large_image_position()
-        elif event.type() == QEvent.Leave and source is self.scroll_area.viewport():
-            self.reset_hover_states(None)
-        elif event.type() == QEvent.Scroll and source is self.scroll_area.viewport():
-            self.lazy_load_images()
-        elif source == self.large_image_label and event.type() == QEvent.Enter:
-            self.large_image_label.hide()
-            return True
-        return super().eventFilter(source, event)
-
-    def show_notification(self, image_path, label):
-        folder_name = os.path.basename(os.path.dirname(image_path))
-        file_name = os.path.basename(image_path)
-        label_rect = label.geometry()
-        if label_rect.center().x() > self.width() // 2:
-            position = 'left'
-        else:
-            position = 'right'
-        self.notification_box.show_notification(f"{folder_name}/{file_name}", position)
-
-    def resizeEvent(self, event):
-        super().resizeEvent(event)
-        self.reposition_images()
-        self.update_large_image_position()
-        self.updateGeometry()  
-
-    def hide_large_image(self):
-        self.large_image_label.hide()
-        
-    def show_large_image(self, image_path, label):
-        if not os.path.exists(image_path):
-            print(f"File not found: {image_path}")
+                copied = copy_data(source_file, destination_file, source_stat.st_size, is_cancelled, on_bytes)
+                if copied != source_stat.st_size:
+                    raise OSError(f"{source} changed while being copied: {copied} of {source_stat.st_size} bytes read")
+        shutil.copystat(source, partial)
+        os.replace(partial, destination)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return True
+
+
+def export_thumbnail(resized, destination, is_cancelled=None, on_bytes=None):
+    # Thumbnails are exported as stored in the cache; only pack entries have to be encoded
+    if not PackStore.is_locator(resized):
+        return copy_file(resized, destination, is_cancelled, on_bytes)
+    img = PackStore.read_image(resized)
+    if Image.registered_extensions().get(os.path.splitext(destination)[1].lower()) == "JPEG":
+        img = img.convert("RGB")
+    save_level(img, destination)
+    return True
+
+
+def plan_copies(items, folder, use_thumbnails=False):
+    # Returns (source, destination) pairs. Originals from different folders that share a name
+    # get numbered instead of overwriting each other.
+    copies = []
+    taken = set()
+    for item in items:
+        name, ext = os.path.splitext(os.path.basename(item["original"]))
+        destination = os.path.join(folder, name + ext)
+        number = 2
+        while destination in taken:
+            destination = os.path.join(folder, f"{name} ({number}){ext}")
+            number += 1
+        taken.add(destination)
+        copies.append((item["resized"] if use_thumbnails else item["original"], destination))
+    return copies
+
+
+def copy_files(copies, use_thumbnails=False, workers=COPY_WORKERS, on_progress=None, is_cancelled=None):
+    # Copies (source, destination) pairs on a thread pool; the copies wait on I/O with the GIL released.
+    # on_progress gets (files done, bytes done) from the worker threads.
+    copy = export_thumbnail if use_thumbnails else copy_file
+    lock = threading.Lock()
+    progress = {"files": 0, "bytes": 0}
+    copied = []
+    skipped = []
+    failed = []
+
+    def on_bytes(count):
+        with lock:
+            progress["bytes"] += count
+            files, done = progress["files"], progress["bytes"]
+        if on_progress:
+            on_progress(files, done)
+
+    def run(source, destination):
+        if is_cancelled and is_cancelled():
             return
-        if image_path.lower().endswith('.gif'):
-            movie = QMovie(image_path)
-            self.large_image_label.setMovie(movie)
-            movie.start()
-            # Scale the GIF to fit within the label while maintaining aspect ratio
-            movie.setScaledSize(self.calculate_scaled_size(movie))
-        else:
-            img = Image.open(image_path)
-            img = img.convert("RGBA")
-            data = img.tobytes("raw", "RGBA")
-            qimg = QImage(data, img.width, img.height, QImage.Format_RGBA8888)
-            pixmap = QPixmap.fromImage(qimg)
-            self.large_image_label.setPixmap(pixmap)
-        self.large_image_label.installEventFilter(self)
-        self.update_large_image_position(label)
-        self.large_image_label.show()
-
-    def calculate_scaled_size(self, movie):
-        original_size = movie.currentImage().size()
-        label_size = self.large_image_label.size()
-        aspect_ratio = original_size.width() / original_size.height()
-        if label_size.width() / aspect_ratio <= label_size.height():
-            return QSize(label_size.width(), int(label_size.width() / aspect_ratio))
-        else:
-            return QSize(int(label_size.height() * aspect_ratio), label_size.height())
-
-    def update_large_image_position(self, label=None):
-        if not hasattr(self, 'large_image_label') or self.large_image_label is None:
-            return  # Exit the method if large_image_label doesn't exist
-        if label and label.isVisible():
-            label_rect = label.geometry()
-            if label_rect.center().x() > self.width() // 2:
-                self.large_image_label.setGeometry(0, 0, self.width() // 2, self.height())
-            else:
-                self.large_image_label.setGeometry(self.width() // 2, 0, self.width() // 2, self.height())
-        else:
-            self.large_image_label.setGeometry(self.width() // 2, 0, self.width() // 2, self.height())
-        # Center the image vertically and horizontally if it's larger
-        pixmap = self.large_image_label.pixmap()
-        if pixmap:
-            scaled_pixmap = pixmap.scaled(self.large_image_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            self.large_image_label.setPixmap(scaled_pixmap)
-            self.large_image_label.setAlignment(Qt.AlignCenter)
+        try:
+            (copied if copy(source, destination, is_cancelled, on_bytes) else skipped).append(destination)
+        except CopyCancelled:
+            return
+        except OSError as e:
+            print(f"Failed to copy {source} to {destination}: {e}")
+            failed.append(source)
+        with lock:
+            progress["files"] += 1
+            files, done = progress["files"], progress["bytes"]
+        if on_progress:
+            on_progress(files, done)
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for future in [executor.submit(run, source, destination) for source, destination in copies]:
+            future.result()
+    return CopyResult(copied, skipped, failed, bool(is_cancelled and is_cancelled()))
 
 
-def main():
+def is_image(file_name):
+    image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
+    _, ext = os.path.splitext(file_name)
+    return ext.lower() in image_extensions
+
+
+def configure_metrics(path, log_every=0):
+    # --metrics <file.json|file.csv> turns the counters on and dumps them there on exit;
+    # --log-every N prints one "Resized" line per N images
+    metrics.configure(bool(path), int(log_every or 0))
+    if path:
+        atexit.register(metrics.dump, os.path.abspath(path))
+
+
+def default_cache_folder(original_folder):
+    # Named after the folder plus a hash of its path, so folders that share a name get their own cache.
+    # A cache from older releases, named after the folder alone, is kept while it belongs to this folder.
+    original_folder = os.path.normpath(os.path.abspath(original_folder))
+    name = os.path.basename(original_folder)
+    legacy = os.path.join(os.getcwd(), "cache", "resized", name)
+    if os.path.exists(os.path.join(legacy, CacheIndex.FILE_NAME)):
+        index = CacheIndex(legacy)
+        try:
+            if index.covers(original_folder):
+                return legacy
+        finally:
+            index.close()
+    digest = hashlib.blake2b(original_folder.encode("utf-8", "surrogateescape"), digest_size=4).hexdigest()
+    return os.path.join(os.getcwd(), "cache", "resized", f"{name}-{digest}")
+
+
+def default_store_folder():
+    return os.path.join(os.getcwd(), "cache", "store")
+
+
+def ask_for_folder():
+    from tkinter import filedialog, Tk
     root = Tk()
     root.withdraw()  # Hide the root window
-    original_folder = filedialog.askdirectory(title="Select Original Image Folder")
+    folder = filedialog.askdirectory(title="Select Original Image Folder")
+    root.destroy()
+    return folder
+
+
+def add_cache_arguments(parser):
+    # The environment variables of older releases still work as defaults
+    parser.add_argument("--cache", help="thumbnail cache folder (default: ./cache/resized/<folder name>-<hash>)")
+    # The store takes a value of its own, so it never swallows the folder argument
+    parser.add_argument("--content-store", metavar="DIR", default=os.environ.get("GALLERY_CONTENT_STORE"),
+                        help="keep thumbnails in this store shared by every folder, filed by content so duplicates are made once")
+    parser.add_argument("--shared-store", action="store_true", help="use the content store in ./cache/store")
+    parser.add_argument("--cache-format", default=os.environ.get("GALLERY_CACHE_FORMAT", "files"), help=f"one of {', '.join(CACHE_FORMATS)}")
+    parser.add_argument("--animation-format", default=os.environ.get("GALLERY_ANIMATION_FORMAT", "gif"), help=f"one of {', '.join(ANIMATION_FORMATS)}")
+    parser.add_argument("--animation-frames", type=int, default=int(os.environ.get("GALLERY_ANIMATION_FRAMES") or ANIMATION_MAX_FRAMES),
+                        help=f"most frames kept in an animated thumbnail (default: {ANIMATION_MAX_FRAMES})")
+    parser.add_argument("--animation-mb", type=float, default=float(os.environ.get("GALLERY_ANIMATION_MB") or ANIMATION_MAX_BYTES / (1024 * 1024)),
+                        help=f"decoded megabytes an animated thumbnail may take (default: {ANIMATION_MAX_BYTES // (1024 * 1024)})")
+    parser.add_argument("--metrics", default=os.environ.get("GALLERY_METRICS"), help="write timing metrics to this .json or .csv file on exit")
+    parser.add_argument("--log-every", type=int, default=int(os.environ.get("GALLERY_LOG_EVERY") or 0), help="print one line per N resized images")
+
+
+def check_store_folder(parser, store, original_folder):
+    # Thumbnails stored inside the source folder would be scanned as originals
+    store = os.path.realpath(store)
+    original_folder = os.path.realpath(original_folder)
+    if os.path.commonpath([store, original_folder]) == original_folder:
+        parser.error(f"the content store {store} cannot be inside the folder of originals {original_folder}")
+
+
+def parse_cache_arguments(parser, argv):
+    args = parser.parse_args(argv)
+    if args.shared_store and not args.content_store:
+        args.content_store = default_store_folder()
+    if args.cache_format not in CACHE_FORMATS:
+        parser.error(f"unknown cache format {args.cache_format!r}, expected one of {', '.join(CACHE_FORMATS)}")
+    if args.animation_format not in ANIMATION_FORMATS:
+        parser.error(f"unknown animation format {args.animation_format!r}, expected one of {', '.join(ANIMATION_FORMATS)}")
+    if args.animation_frames < 1 or args.animation_mb <= 0:
+        parser.error("--animation-frames and --animation-mb must be positive")
+    if args.content_store and args.cache_format == "pack":
+        parser.error("the content store keeps thumbnails as files; it cannot be combined with --cache-format pack")
+    # A missing folder would look like every cached image was deleted
+    if args.folder and not os.path.isdir(args.folder):
+        parser.error(f"{args.folder} is not a folder")
+    if args.folder and args.content_store:
+        check_store_folder(parser, args.content_store, args.folder)
+    configure_metrics(args.metrics, args.log_every)
+    return args, CacheOptions(args.cache_format, args.animation_format, args.content_store and os.path.abspath(args.content_store),
+                              args.animation_frames, int(args.animation_mb * 1024 * 1024))
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class ProgressReport:
+    # Prints throughput and time left, at most once per interval and always for the last batch
+    def __init__(self, stream=None, interval=1.0):
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last = 0.0
+
+    def __call__(self, done, failed, total):
+        now = time.perf_counter()
+        finished = done + failed
+        if now - self.last < self.interval and finished < total:
+            return
+        self.last = now
+        rate = finished / (now - self.start)
+        eta = (total - finished) / rate if rate else 0
+        failures = f", {failed} failed" if failed else ""
+        print(f"{finished}/{total} images, {rate:.1f} images/s, {format_duration(eta)} left{failures}", file=self.stream, flush=True)
+
+
+def build_cache(argv):
+    parser = argparse.ArgumentParser(prog="gallery build-cache", description="Make or refresh the thumbnail cache of a folder without opening a window. Run it again to resume an interrupted build.")
+    parser.add_argument("folder", help="folder of original images")
+    add_cache_arguments(parser)
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="images per worker task")
+    parser.add_argument("--claim-wait", type=float, default=CLAIM_WAIT_SECONDS,
+                        help="seconds to wait for images other builds have claimed when none of them gets done, before skipping them")
+    args, options = parse_cache_arguments(parser, argv)
+    try:
+        result = update_cache(args.folder, args.cache or default_cache_folder(args.folder), workers=args.workers,
+                              batch_size=args.batch_size, options=options, on_progress=ProgressReport(), claim_wait=args.claim_wait)
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume", file=sys.stderr)
+        return 130
+    return 1 if result.failed or result.skipped else 0
+
+
+def gc_store(argv):
+    parser = argparse.ArgumentParser(prog="gallery gc-store", description="Delete the thumbnails in a content store that no library uses any more.")
+    parser.add_argument("store", nargs="?", default=os.environ.get("GALLERY_CONTENT_STORE") or default_store_folder(), help="content store folder (default: ./cache/store)")
+    args = parser.parse_args(argv)
+    if not os.path.exists(os.path.join(args.store, ContentStore.FILE_NAME)):
+        parser.error(f"{args.store} is not a content store")
+    store = ContentStore(args.store)
+    try:
+        print(f"Removed {store.gc()} unused thumbnails from {store.folder}")
+    finally:
+        store.close()
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["build-cache"]:
+        return build_cache(argv[1:])
+    if argv[:1] == ["gc-store"]:
+        return gc_store(argv[1:])
+    parser = argparse.ArgumentParser(prog="gallery", description="Browse the images in a folder. 'gallery build-cache FOLDER' makes the thumbnails without a window, 'gallery gc-store' cleans up a content store.")
+    parser.add_argument("folder", nargs="?", help="folder of original images (default: ask)")
+    parser.add_argument("--watch", action="store_true", help="keep the gallery in sync with the folder")
+    parser.add_argument("--poll", action="store_true", help="with --watch, rescan every few seconds instead of using file system events")
+    parser.add_argument("--copy-workers", type=int, default=COPY_WORKERS, help=f"files copied at once by Copy Selected to (default: {COPY_WORKERS})")
+    add_cache_arguments(parser)
+    args, options = parse_cache_arguments(parser, argv)
+    original_folder = args.folder or ask_for_folder()
     if not original_folder:
         print("No directory selected. Exiting.")
-        return
-    cache_resized_folder = os.path.join(os.getcwd(), "cache", "resized", os.path.basename(original_folder))
-    json_path = resize_images_and_generate_json(original_folder, cache_resized_folder)
-    app = QApplication(sys.argv)
-    gallery = ImageGallery()
-    gallery.load_json(json_path)
-    gallery.show()
-    sys.exit(app.exec_())
+        return 0
+    if options.content_store:
+        check_store_folder(parser, options.content_store, original_folder)
+    watch = ("poll" if args.poll else "auto") if args.watch or args.poll else None
+    import gallery_ui
+    return gallery_ui.run(original_folder, args.cache or default_cache_folder(original_folder), options, sys.argv[:1], watch, args.copy_workers)
 
 if __name__ == "__main__":
-    main()
+    multiprocessing.freeze_support()  # Needed for the process pool in PyInstaller builds
+    # Run through the importable module so gallery_ui shares its state (metrics) with the entry point
+    import gallery
+    sys.exit(gallery.main())
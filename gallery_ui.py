@@ -0,0 +1,1265 @@
+import os
+import collections
+import itertools
+import operator
+import threading
+import mmap
+import time
+from PIL import Image
+from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QLabel, QVBoxLayout, QWidget, QAction, QMessageBox, QCheckBox, QDialog, QDialogButtonBox, QListView, QAbstractItemView, QStyledItemDelegate, QProgressDialog, QToolBar, QLineEdit, QComboBox, QSpinBox
+from PyQt5.QtGui import QPixmap, QImage, QPainter, QColor
+from PyQt5.QtCore import QSize, Qt, QEvent, QPropertyAnimation, QVariantAnimation, pyqtSignal, QTimer, QRect, QPoint, QThread, QThreadPool, QRunnable, QObject, QAbstractListModel, QModelIndex, QFileSystemWatcher, QElapsedTimer
+from PyQt5.QtGui import QMovie
+from gallery import (DISPLAY_THUMBNAIL_SIZE, ZOOM_THUMBNAIL_SIZE, PREVIEW_LEVEL_SIZE, DEFAULT_CACHE_OPTIONS, COPY_WORKERS,
+                     CacheIndex, PackStore, update_cache, plan_copies, copy_files, metrics)
+
+# Qt side of the gallery; gallery.py imports this only when a window is opened
+
+
+GRID_COLUMN_WIDTH = 250
+GRID_ROW_HEIGHT = 220
+HOVER_SCALE = 1.1
+PIXMAP_CACHE_BYTES = 256 * 1024 * 1024
+PREVIEW_CACHE_BYTES = 128 * 1024 * 1024
+# The stored preview level is shown enlarged up to this much before the original is decoded instead
+PREVIEW_MAX_UPSCALE = 1.5
+MAX_PLAYING_ANIMATIONS = 12
+# Viewport paints slower than this are recorded separately when metrics are enabled
+SLOW_PAINT_SECONDS = 0.016
+# Folder events are batched until nothing changed for WATCH_DEBOUNCE_MS, but a steady
+# stream of events still gets flushed every WATCH_MAX_DELAY_MS
+WATCH_DEBOUNCE_MS = 500
+WATCH_MAX_DELAY_MS = 3000
+WATCH_POLL_MS = 5000
+# Folder watches report files created, deleted or moved, but not ones written in place. Recently
+# made or failed originals are watched themselves, as they may still be being written, and a slow
+# stat-only rescan catches the rest. Failed originals are only tried again once they change.
+WATCH_RECENT_FILES = 256
+WATCH_RESCAN_MS = 60 * 1000
+# Typing in the filter box reapplies the view once it pauses for this long
+FILTER_DEBOUNCE_MS = 150
+# Sort keys over the metadata in the cache index, precomputed by ImageListModel.prepare; None keeps folder order
+SORT_KEYS = {
+    "Folder order": None,
+    "Name": operator.itemgetter("name"),
+    "Date taken": operator.itemgetter("date"),
+    "Modified": operator.itemgetter("mtime_ns"),
+    "File size": operator.itemgetter("size"),
+    "Dimensions": operator.itemgetter("pixels"),
+}
+ViewOptions = collections.namedtuple("ViewOptions", ["sort", "descending", "text", "animated_only", "min_size"])
+DEFAULT_VIEW_OPTIONS = ViewOptions("Folder order", False, "", False, 0)
+
+
+class PackReader:
+    # Maps pack files read-only and copies QImages straight out of the mapping, without a decode
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.maps = {}
+
+    def mapping(self, path, end):
+        with self.lock:
+            mapped = self.maps.get(path)
+            if mapped is None or len(mapped) < end:
+                # The pack grew since it was mapped. Only the newest mapping is kept; an older one
+                # is unmapped once the reads still using it are done.
+                with open(path, "rb") as pack:
+                    mapped = self.maps[path] = mmap.mmap(pack.fileno(), 0, access=mmap.ACCESS_READ)
+            return mapped
+
+    def read(self, locator):
+        path, offset = PackStore.parse_locator(locator)
+        header_end = offset + PackStore.HEADER.size
+        magic, width, height = PackStore.HEADER.unpack_from(self.mapping(path, header_end), offset)
+        if magic != PackStore.MAGIC:
+            raise OSError(f"Corrupt pack entry {locator}")
+        end = header_end + width * height * 4
+        data = memoryview(self.mapping(path, end))[header_end:end]
+        # Copied, so no QImage points into a mapping that may be dropped
+        image = QImage(data, width, height, width * 4, QImage.Format_RGBA8888).copy()
+        data.release()
+        return image
+
+
+pack_reader = PackReader()
+
+
+def load_thumbnail(img_path, max_size=DISPLAY_THUMBNAIL_SIZE):
+    # Returns a QImage so it can run on a worker thread; QPixmaps are made on the GUI thread
+    with metrics.timer("gui.load_thumbnail"):
+        if PackStore.is_locator(img_path):
+            # Already in display format, no decode needed
+            return pack_reader.read(img_path)
+        img = Image.open(img_path)
+        if img.width > max_size[0] or img.height > max_size[1]:
+            # Only thumbnails from caches older than the pyramid levels need resampling
+            img.thumbnail(max_size)
+        img = img.convert("RGBA")
+        data = img.tobytes("raw", "RGBA")
+        return QImage(data, img.width, img.height, QImage.Format_RGBA8888).copy()
+
+
+class PixmapCache:
+    # LRU of decoded pixmaps bounded by their size in bytes
+    def __init__(self, max_bytes=PIXMAP_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.pixmaps = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.pixmaps)
+
+    def __contains__(self, key):
+        return key in self.pixmaps
+
+    @staticmethod
+    def cost(pixmap):
+        return max(64, pixmap.width() * pixmap.height() * max(1, pixmap.depth() // 8))
+
+    def get(self, key):
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap):
+        self.pop(key)
+        self.pixmaps[key] = pixmap
+        self.total_bytes += self.cost(pixmap)
+        while self.total_bytes > self.max_bytes and len(self.pixmaps) > 1:
+            _, evicted = self.pixmaps.popitem(last=False)
+            self.total_bytes -= self.cost(evicted)
+
+    def pop(self, key):
+        pixmap = self.pixmaps.pop(key, None)
+        if pixmap is not None:
+            self.total_bytes -= self.cost(pixmap)
+        return pixmap
+
+
+def load_preview(img_path, max_size, enlarge_to=None):
+    # Decodes just enough of the original to fill a max_size panel; a stored level a little
+    # smaller than the panel is enlarged to enlarge_to
+    with metrics.timer("gui.load_preview"), Image.open(img_path) as img:
+        if img.format == 'JPEG':
+            img.draft(img.mode, max_size)
+        img.thumbnail(max_size, Image.LANCZOS, reducing_gap=2.0)
+        if enlarge_to is not None:
+            img = img.resize(enlarge_to, Image.BICUBIC)
+        img = img.convert("RGBA")
+        data = img.tobytes("raw", "RGBA")
+        return QImage(data, img.width, img.height, QImage.Format_RGBA8888).copy()
+
+
+class ImageLoader(QObject):
+    # Runs decode(key) on a QThreadPool; the most recently requested keys are decoded first
+    loaded = pyqtSignal(object, QImage)
+
+    def __init__(self, decode, parent=None, max_threads=None):
+        super().__init__(parent)
+        self.decode = decode
+        self.pool = QThreadPool(self)
+        if max_threads:
+            self.pool.setMaxThreadCount(max_threads)
+        self.lock = threading.Lock()
+        self.queue = collections.OrderedDict()
+        self.running = set()
+        self.tasks = 0
+
+    def request(self, key):
+        with self.lock:
+            if key in self.running:
+                return
+            if key in self.queue:
+                self.queue.move_to_end(key)
+                return
+            self.queue[key] = True
+            if self.tasks >= self.pool.maxThreadCount():
+                return
+            self.tasks += 1
+        self.pool.start(LoaderTask(self))
+
+    def discard_except(self, keys):
+        # Drop queued work that is no longer wanted, e.g. tiles scrolled past before being decoded
+        with self.lock:
+            for key in [key for key in self.queue if key not in keys]:
+                del self.queue[key]
+
+    def next_key(self):
+        with self.lock:
+            if not self.queue:
+                self.tasks -= 1
+                return None
+            key, _ = self.queue.popitem()
+            self.running.add(key)
+            return key
+
+    def finish(self, key, image):
+        with self.lock:
+            self.running.discard(key)
+        self.loaded.emit(key, image)
+
+    def wait(self):
+        with self.lock:
+            self.queue.clear()
+        self.pool.waitForDone()
+
+
+class LoaderTask(QRunnable):
+    def __init__(self, loader):
+        super().__init__()
+        self.loader = loader
+
+    def run(self):
+        while True:
+            key = self.loader.next_key()
+            if key is None:
+                return
+            try:
+                image = self.loader.decode(key)
+            except Exception:
+                image = QImage()
+            self.loader.finish(key, image)
+
+
+class ImageListModel(QAbstractListModel):
+    OriginalRole = Qt.UserRole + 1
+    ToggledRole = Qt.UserRole + 2
+    ZoomRole = Qt.UserRole + 3
+
+    def __init__(self, parent=None, cache_bytes=PIXMAP_CACHE_BYTES):
+        super().__init__(parent)
+        # library holds every indexed image; items and rows are the filtered, sorted rows on screen
+        self.library = {}
+        self.items = []
+        self.rows = {}
+        self.view_options = DEFAULT_VIEW_OPTIONS
+        self.toggled = set()
+        # Only tiles that get painted are decoded; evicted ones are decoded again when repainted
+        self.pixmaps = PixmapCache(cache_bytes)
+        self.waiting = collections.defaultdict(set)
+        self.loader = ImageLoader(lambda key: load_thumbnail(*key), self)
+        self.loader.loaded.connect(self.thumbnail_loaded)
+        self.animations = AnimationScheduler(self)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.items)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item = self.items[index.row()]
+        if role == Qt.DecorationRole:
+            return self.thumbnail(item)
+        if role == self.OriginalRole:
+            return item["original"]
+        if role == self.ToggledRole:
+            return item["original"] in self.toggled
+        if role == self.ZoomRole:
+            return self.zoom_thumbnail(item)
+        return None
+
+    def thumbnail(self, item):
+        resized = item["resized"]
+        frame = self.animations.frame(item["original"])
+        if frame is not None:
+            return frame
+        # Animations that are not playing show their first frame, decoded like any other thumbnail
+        pixmap = self.pixmaps.get(resized)
+        if pixmap is None:
+            self.request_thumbnail(item)
+        return pixmap
+
+    def zoom_thumbnail(self, item):
+        # The stored hover-zoom level, so zoomed tiles are not upscaled from the grid level
+        zoom = item.get("zoom")
+        if not zoom or self.animations.frame(item["original"]) is not None:
+            return None
+        pixmap = self.pixmaps.get(zoom)
+        if pixmap is None:
+            self.request_thumbnail(item, zoom, ZOOM_THUMBNAIL_SIZE)
+        return pixmap
+
+    def request_thumbnail(self, item, path=None, max_size=DISPLAY_THUMBNAIL_SIZE):
+        path = path or item["resized"]
+        self.waiting[path].add(item["original"])
+        self.loader.request((path, max_size))
+
+    def thumbnail_loaded(self, key, image):
+        path, _ = key
+        self.pixmaps.put(path, QPixmap.fromImage(image))
+        for original in self.waiting.pop(path, ()):
+            self.refresh(original)
+
+    def prefetch(self, rows):
+        # Queue decodes for rows about to scroll into view and cancel the rest
+        keys = set()
+        for row in rows:
+            item = self.items[row]
+            keys.add((item["resized"], DISPLAY_THUMBNAIL_SIZE))
+            if item["resized"] not in self.pixmaps:
+                self.request_thumbnail(item)
+        self.loader.discard_except(keys)
+
+    def index_of(self, original):
+        row = self.rows.get(original)
+        return QModelIndex() if row is None else self.index(row)
+
+    def refresh(self, original):
+        index = self.index_of(original)
+        if index.isValid():
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def forget(self, item):
+        self.pixmaps.pop(item["resized"])
+        if item.get("zoom"):
+            self.pixmaps.pop(item["zoom"])
+        self.animations.stop(item["original"])
+
+    @staticmethod
+    def prepare(item):
+        # Precomputed so sorting and filtering are plain lookups, with no formatting or lower-casing per comparison
+        item["name"] = os.path.basename(item["original"]).lower()
+        item["size"] = item.get("size") or 0
+        item["mtime_ns"] = item.get("mtime_ns") or 0
+        item["pixels"] = (item.get("width") or 0) * (item.get("height") or 0)
+        item["animated"] = bool(item.get("animation")) or (item.get("frames") or 1) > 1
+        item["date"] = item.get("taken") or (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(item["mtime_ns"] / 1e9)) if item["mtime_ns"] else "")
+
+    def matches(self, item):
+        options = self.view_options
+        return ((not options.text or options.text in item["name"]) and (not options.animated_only or item["animated"])
+                and item["size"] >= options.min_size)
+
+    def arrange(self, items):
+        options = self.view_options
+        if options.text or options.animated_only or options.min_size:
+            items = [item for item in items if self.matches(item)]
+        else:
+            items = list(items)
+        key = SORT_KEYS[options.sort]
+        if key is None:
+            # Folder order is the order images were indexed and streamed in
+            return items[::-1] if options.descending else items
+        # Timsort is close to linear when most of the list is already in order
+        return sorted(items, key=key, reverse=options.descending)
+
+    def index_rows(self):
+        self.rows = dict(zip(map(operator.itemgetter("original"), self.items), itertools.count()))
+
+    def set_view(self, view_options):
+        self.view_options = view_options
+        self.beginResetModel()
+        self.items = self.arrange(self.library.values())
+        self.index_rows()
+        self.endResetModel()
+
+    def relayout(self, items):
+        # Rows move but the view keeps its scroll position, unlike a model reset
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        originals = [self.items[index.row()]["original"] for index in persistent]
+        self.items = items
+        self.index_rows()
+        self.changePersistentIndexList(persistent, [self.index_of(original) for original in originals])
+        self.layoutChanged.emit()
+
+    def update_items(self, items):
+        new_items = []
+        moved = False
+        hidden = []
+        key = SORT_KEYS[self.view_options.sort]
+        for item in items:
+            self.prepare(item)
+            original = item["original"]
+            previous = self.library.get(original)
+            self.library[original] = item
+            if previous is not None:
+                self.forget(previous)
+            row = self.rows.get(original)
+            if not self.matches(item):
+                if row is not None:
+                    hidden.append(original)
+            elif row is None:
+                new_items.append(item)
+            else:
+                # A changed original keeps its tile, only the thumbnail is reloaded
+                self.items[row] = item
+                self.refresh(original)
+                moved = moved or (key is not None and key(previous) != key(item))
+        if hidden:
+            self.remove_rows(hidden)
+        if not new_items and not moved:
+            return
+        if key is None and not self.view_options.descending:
+            self.beginInsertRows(QModelIndex(), len(self.items), len(self.items) + len(new_items) - 1)
+            for row, item in enumerate(new_items, len(self.items)):
+                self.rows[item["original"]] = row
+            self.items.extend(new_items)
+            self.endInsertRows()
+        elif key is None:
+            self.relayout(new_items[::-1] + self.items)
+        else:
+            self.relayout(sorted(self.items + new_items, key=key, reverse=self.view_options.descending))
+
+    def update_metadata(self, entries):
+        # Metadata read for images indexed before it was recorded; only the sort and filters use it
+        for entry in entries:
+            item = self.library.get(entry["original"])
+            if item is not None:
+                item.update(entry)
+                self.prepare(item)
+        if self.view_options != DEFAULT_VIEW_OPTIONS:
+            self.relayout(self.arrange(self.library.values()))
+
+    def remove_items(self, originals):
+        for original in originals:
+            item = self.library.pop(original, None)
+            if item is not None:
+                self.forget(item)
+                self.toggled.discard(original)
+        self.remove_rows(originals)
+
+    def remove_rows(self, originals):
+        rows = sorted((self.rows[original] for original in originals if original in self.rows), reverse=True)
+        if not rows:
+            return
+        # Remove contiguous runs from the end so earlier row numbers stay valid
+        while rows:
+            last = first = rows.pop(0)
+            while rows and rows[0] == first - 1:
+                first = rows.pop(0)
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.items[first:last + 1]
+            self.endRemoveRows()
+        self.index_rows()
+
+    def toggle(self, row):
+        original = self.items[row]["original"]
+        if original in self.toggled:
+            self.toggled.remove(original)
+        else:
+            self.toggled.add(original)
+        self.refresh(original)
+
+    def clear_toggles(self):
+        toggled, self.toggled = self.toggled, set()
+        for original in toggled:
+            self.refresh(original)
+
+    def toggled_items(self):
+        # Toggles survive filtering, so hidden toggled images are copied too
+        return [item for item in self.library.values() if item["original"] in self.toggled]
+
+
+class AnimationScheduler(QObject):
+    # Plays the animated tiles in the viewport, at most max_playing at once.
+    # Tiles over the budget keep their poster frame and off-screen movies are freed.
+    def __init__(self, model, max_playing=MAX_PLAYING_ANIMATIONS):
+        super().__init__(model)
+        self.model = model
+        self.max_playing = max_playing
+        self.movies = {}
+
+    def frame(self, original):
+        movie = self.movies.get(original)
+        if movie is None:
+            return None
+        pixmap = movie.currentPixmap()
+        return None if pixmap.isNull() else pixmap
+
+    def update(self, items):
+        # Called whenever the set of visible tiles changes; items are in viewport order
+        playing = [item for item in items if item.get("animation")][:self.max_playing]
+        originals = {item["original"] for item in playing}
+        for original in [original for original in self.movies if original not in originals]:
+            self.stop(original)
+        for item in playing:
+            if item["original"] not in self.movies:
+                self.start(item)
+
+    def start(self, item):
+        original = item["original"]
+        movie = QMovie(item["animation"], parent=self)
+        movie.jumpToFrame(0)
+        size = movie.currentImage().size()
+        if size.width() > DISPLAY_THUMBNAIL_SIZE[0] or size.height() > DISPLAY_THUMBNAIL_SIZE[1]:
+            size.scale(QSize(*DISPLAY_THUMBNAIL_SIZE), Qt.KeepAspectRatio)
+            movie.setScaledSize(size)
+        movie.frameChanged.connect(lambda _, original=original: self.model.refresh(original))
+        self.movies[original] = movie
+        movie.start()
+
+    def stop(self, original):
+        movie = self.movies.pop(original, None)
+        if movie is not None:
+            movie.stop()
+            movie.deleteLater()
+            self.model.refresh(original)
+
+
+class ThumbnailDelegate(QStyledItemDelegate):
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+
+    def sizeHint(self, option, index):
+        return self.view.gridSize()
+
+    def paint(self, painter, option, index):
+        pixmap = index.data(Qt.DecorationRole)
+        if pixmap is None or pixmap.isNull():
+            return
+        scale = self.view.scales.get(index.data(ImageListModel.OriginalRole), 1.0)
+        rect = QRect(QPoint(0, 0), pixmap.size() * scale)
+        rect.moveCenter(option.rect.center())
+        if scale != 1.0:
+            # Zoomed tiles draw the closest stored level; at full zoom it is drawn 1:1
+            pixmap = index.data(ImageListModel.ZoomRole) or pixmap
+        painter.save()
+        if pixmap.size() != rect.size():
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.drawPixmap(rect, pixmap)
+        if index.data(ImageListModel.ToggledRole):
+            painter.setPen(QColor(255, 255, 0))
+            painter.drawRect(rect.adjusted(0, 0, -1, -1))
+        painter.restore()
+
+
+class ThumbnailView(QListView):
+    # Virtualized grid: Qt only lays out and paints the rows inside the viewport
+    image_hovered = pyqtSignal(str, QRect)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setFlow(QListView.LeftToRight)
+        self.setWrapping(True)
+        self.setResizeMode(QListView.Adjust)
+        self.setMovement(QListView.Static)
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
+        self.setMouseTracking(True)
+        self.setItemDelegate(ThumbnailDelegate(self))
+        self.hovered_path = None
+        self.zoomed_path = None
+        self.scales = {}
+        self.animations = {}
+
+    def visible_rows(self, margin=0):
+        grid = self.gridSize()
+        if not grid.isValid() or not self.model():
+            return range(0)
+        columns = max(1, (self.viewport().width() - 1) // grid.width())
+        top = max(0, self.verticalOffset() - margin) // grid.height()
+        bottom = (self.verticalOffset() + self.viewport().height() + margin) // grid.height()
+        return range(top * columns, min(self.model().rowCount(), (bottom + 1) * columns))
+
+    def paintEvent(self, event):
+        if not metrics.enabled:
+            return super().paintEvent(event)
+        start = time.perf_counter()
+        super().paintEvent(event)
+        elapsed = time.perf_counter() - start
+        metrics.record("gui.paint", elapsed)
+        if elapsed > SLOW_PAINT_SECONDS:
+            metrics.record("gui.slow_paint", elapsed)
+
+    def dataChanged(self, top_left, bottom_right, roles=()):
+        # Tiles have a fixed size, so new data only needs a repaint. QListView would lay out every
+        # row again, which made each decoded thumbnail, zoom level and animation frame cost O(rows).
+        if top_left == bottom_right:
+            self.update(top_left)
+        else:
+            self.viewport().update()
+
+    def neighbor_rows(self, row):
+        columns = max(1, (self.viewport().width() - 1) // max(1, self.gridSize().width()))
+        rows = (row - columns, row + columns, row - 1, row + 1)
+        return [neighbor for neighbor in rows if 0 <= neighbor < self.model().rowCount()]
+
+    def update_tile(self, original):
+        index = self.model().index_of(original)
+        if index.isValid():
+            self.viewport().update(self.visualRect(index))
+
+    def set_scale(self, original, value):
+        self.scales[original] = value
+        self.update_tile(original)
+
+    def animate_scale(self, original, end_value):
+        animation = self.animations.get(original)
+        if animation is None:
+            animation = QVariantAnimation(self)
+            animation.setDuration(200)
+            animation.valueChanged.connect(lambda value, original=original: self.set_scale(original, value))
+            animation.finished.connect(lambda original=original: self.animation_finished(original))
+            self.animations[original] = animation
+        animation.stop()
+        animation.setStartValue(self.scales.get(original, 1.0))
+        animation.setEndValue(float(end_value))
+        animation.start()
+
+    def animation_finished(self, original):
+        if self.scales.get(original) == 1.0:
+            self.scales.pop(original, None)
+            self.animations.pop(original).deleteLater()
+
+    def set_hovered(self, original):
+        with metrics.timer("gui.hover"):
+            self.hover(original)
+
+    def hover(self, original):
+        self.hovered_path = original
+        if original is None:
+            # A toggled tile stays zoomed until another tile is hovered
+            if self.zoomed_path is not None and not self.model().data(self.model().index_of(self.zoomed_path), ImageListModel.ToggledRole):
+                self.reset_hover()
+            return
+        if self.zoomed_path is not None and self.zoomed_path != original:
+            self.animate_scale(self.zoomed_path, 1.0)
+        self.zoomed_path = original
+        self.animate_scale(original, HOVER_SCALE)
+        index = self.model().index_of(original)
+        rect = self.visualRect(index)
+        self.image_hovered.emit(original, QRect(self.viewport().mapTo(self.window(), rect.topLeft()), rect.size()))
+
+    def reset_hover(self):
+        if self.zoomed_path is not None:
+            self.animate_scale(self.zoomed_path, 1.0)
+        self.zoomed_path = None
+        self.hovered_path = None
+
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        index = self.indexAt(event.pos())
+        original = index.data(ImageListModel.OriginalRole) if index.isValid() else None
+        if original != self.hovered_path:
+            self.set_hovered(original)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            index = self.indexAt(event.pos())
+            if index.isValid():
+                self.model().toggle(index.row())
+
+    def viewportEvent(self, event):
+        if event.type() == QEvent.Leave:
+            self.reset_hover()
+        return super().viewportEvent(event)
+
+
+class NotificationBox(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
+        self.setAttribute(Qt.WA_TranslucentBackground)
+        self.setStyleSheet("background-color: rgba(0, 0, 0, 150); color: white; border-radius: 10px; padding: 10px;")
+        self.label = QLabel(self)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.label)
+        self.setLayout(layout)
+        self.animation = QPropertyAnimation(self, b"windowOpacity")
+        self.animation.setDuration(1000)
+        self.animation.setStartValue(1.0)
+        self.animation.setEndValue(0.0)
+        self.timer = QTimer(self)
+        self.timer.setInterval(2000)
+        self.timer.timeout.connect(self.hide_notification)
+
+    def show_notification(self, text, position):
+        self.label.setText(text)
+        self.adjustSize()
+        if position == 'left':
+            self.move(self.parent().width() - self.width() - 20, 20)
+        else:
+            self.move(20, 20)
+        self.show()
+        self.animation.start()
+        self.timer.start()
+
+    def hide_notification(self):
+        self.timer.stop()
+        self.hide()
+
+class CopyDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Copy Selected Images")
+        self.setGeometry(100, 100, 300, 150)
+        layout = QVBoxLayout(self)
+        self.checkbox = QCheckBox("Use thumbnails instead for this copy", self)
+        layout.addWidget(self.checkbox)
+        self.button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        layout.addWidget(self.button_box)
+        self.button_box.accepted.connect(self.accept)
+        self.button_box.rejected.connect(self.reject)
+
+class CopyWorker(QThread):
+    # Runs copy_files off the GUI thread; the copies themselves run on a thread pool
+    progress = pyqtSignal(int, object)
+
+    def __init__(self, copies, use_thumbnails, workers=COPY_WORKERS, parent=None):
+        super().__init__(parent)
+        self.copies = copies
+        self.use_thumbnails = use_thumbnails
+        self.workers = workers
+        self.cancelled = False
+        self.result = None
+
+    def run(self):
+        self.result = copy_files(self.copies, self.use_thumbnails, self.workers,
+                                 on_progress=self.progress.emit, is_cancelled=lambda: self.cancelled)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def stop(self):
+        self.cancel()
+        self.wait()
+
+
+class CacheWorker(QThread):
+    # Runs update_cache in the background and streams its results to the GUI thread
+    images_updated = pyqtSignal(list)
+    images_removed = pyqtSignal(list)
+    metadata_updated = pyqtSignal(list)
+
+    def __init__(self, original_folder, cache_resized_folder, parent=None, options=DEFAULT_CACHE_OPTIONS, folders=None, watched=False):
+        super().__init__(parent)
+        self.original_folder = original_folder
+        self.cache_resized_folder = cache_resized_folder
+        self.options = options
+        self.folders = folders
+        self.watched = watched
+        self.cancelled = False
+        self.result = None
+
+    def run(self):
+        self.result = update_cache(self.original_folder, self.cache_resized_folder,
+                                   on_removed=self.images_removed.emit, on_batch=self.images_updated.emit, on_metadata=self.metadata_updated.emit,
+                                   is_cancelled=lambda: self.cancelled, options=self.options, folders=self.folders, report_unchanged=not self.watched,
+                                   retry_failed=not self.watched)
+
+    def stop(self):
+        self.cancelled = True
+        self.wait()
+
+class FolderWatcher(QObject):
+    # Watches every folder below root and emits the folders that changed in debounced batches.
+    # Falls back to polling, which emits None for a full stat-only rescan, when the platform
+    # watcher is asked for or runs out of watches.
+    folders_changed = pyqtSignal(object)
+
+    def __init__(self, root, parent=None, poll=False):
+        super().__init__(parent)
+        self.root = os.path.abspath(root)
+        self.watched = set()
+        self.dirty = set()
+        # Watched files, oldest first
+        self.recent = {}
+        self.since_first_event = QElapsedTimer()
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(WATCH_DEBOUNCE_MS)
+        self.debounce_timer.timeout.connect(self.flush)
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(WATCH_POLL_MS)
+        self.poll_timer.timeout.connect(lambda: self.folders_changed.emit(None))
+        self.rescan_timer = QTimer(self)
+        self.rescan_timer.setInterval(WATCH_RESCAN_MS)
+        self.rescan_timer.timeout.connect(lambda: self.folders_changed.emit(None))
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.folder_changed)
+        self.watcher.fileChanged.connect(lambda path: self.folder_changed(os.path.dirname(path)))
+        if poll:
+            self.start_polling()
+        else:
+            self.watch_tree(self.root)
+            self.rescan_timer.start()
+
+    def polling(self):
+        return self.poll_timer.isActive()
+
+    def start_polling(self):
+        # Every poll compares all files, so the file watches are not needed either
+        if not self.polling():
+            if self.watcher.directories() or self.watcher.files():
+                self.watcher.removePaths(self.watcher.directories() + self.watcher.files())
+            self.watched.clear()
+            self.dirty.clear()
+            self.recent.clear()
+            self.rescan_timer.stop()
+            self.poll_timer.start()
+
+    def watch_tree(self, folder):
+        # Returns the folders that started being watched
+        folders = [os.path.abspath(path) for path, _, _ in os.walk(folder)]
+        folders = [path for path in folders if path not in self.watched]
+        if folders and self.watcher.addPaths(folders):
+            print(f"Cannot watch every folder below {self.root}, polling every {WATCH_POLL_MS // 1000} s instead")
+            self.start_polling()
+            return []
+        self.watched.update(folders)
+        return folders
+
+    def folder_changed(self, folder):
+        # Runs for every event, so it only records the folder
+        self.dirty.add(os.path.abspath(folder))
+        if not self.debounce_timer.isActive():
+            self.since_first_event.start()
+            self.debounce_timer.start()
+        elif self.since_first_event.elapsed() < WATCH_MAX_DELAY_MS:
+            # Restarting pushes the flush back; past the maximum delay the timer is left to run out
+            self.debounce_timer.start()
+
+    def watch_files(self, paths):
+        # Keeps the WATCH_RECENT_FILES most recently passed files watched
+        if self.polling():
+            return
+        added = [path for path in paths if path not in self.recent]
+        for path in paths:
+            self.recent.pop(path, None)
+            self.recent[path] = None
+        if added:
+            self.watcher.addPaths(added)
+        old = list(itertools.islice(self.recent, max(0, len(self.recent) - WATCH_RECENT_FILES)))
+        for path in old:
+            del self.recent[path]
+        if old:
+            self.watcher.removePaths(old)
+
+    def files_made(self, originals):
+        # Thumbnailed originals may still be written to, as by a program saving in several steps,
+        # and ones that could not be read may be half written; writing more to either changes
+        # their stat, so the next update looks at them again
+        self.watch_files(originals)
+
+    def forget_tree(self, folder):
+        # Returns the watched folders at or below folder, which are no longer watched
+        gone = {path for path in self.watched if path == folder or path.startswith(folder + os.sep)}
+        self.watched -= gone
+        stale = [path for path in self.watcher.directories() if os.path.abspath(path) in gone]
+        if stale:
+            self.watcher.removePaths(stale)
+        return gone
+
+    def flush(self):
+        folders, self.dirty = self.dirty, set()
+        for folder in list(folders):
+            if not os.path.isdir(folder):
+                # A folder deleted or moved out takes its subfolders with it
+                folders |= self.forget_tree(folder)
+                continue
+            try:
+                with os.scandir(folder) as it:
+                    subfolders = {entry.path for entry in it if entry.is_dir(follow_symlinks=False)}
+            except OSError:
+                continue
+            # Folders created or moved in are watched from now on and their images count as changed.
+            # A subfolder moved out does not always report itself, so its parent's listing decides.
+            for subfolder in subfolders - self.watched:
+                folders.update(self.watch_tree(subfolder))
+            for subfolder in [path for path in self.watched if os.path.dirname(path) == folder and path not in subfolders]:
+                folders |= self.forget_tree(subfolder)
+        if folders and not self.polling():
+            self.folders_changed.emit(folders)
+
+
+class ImageGallery(QMainWindow):
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Image Gallery")
+        self.model = ImageListModel(self)
+        self.view = ThumbnailView(self)
+        self.view.setModel(self.model)
+        self.view.image_hovered.connect(self.image_hovered)
+        self.setCentralWidget(self.view)
+        self.pending_images = []
+        self.cache_worker = None
+        self.folder_watcher = None
+        self.copy_worker = None
+        self.copy_workers = COPY_WORKERS
+        # Folders the watcher reported while the cache worker was busy; None means rescan everything
+        self.watched_changes = set()
+        # Streamed thumbnails are queued and added to the grid in bursts
+        self.pending_timer = QTimer(self)
+        self.pending_timer.setSingleShot(True)
+        self.pending_timer.setInterval(100)
+        self.pending_timer.timeout.connect(self.add_pending_images)
+        self.view.viewport().installEventFilter(self)
+        self.view.verticalScrollBar().valueChanged.connect(self.lazy_load_images)
+        self.notification_box = NotificationBox(self)
+        self.large_image_label = QLabel(self)
+        self.large_image_label.setStyleSheet("""
+            background-color: rgba(0, 0, 0, 150);
+            border: 2px solid white;
+            border-radius: 10px;
+            padding: 10px;
+        """)
+        self.large_image_label.setAlignment(Qt.AlignCenter)
+        self.large_image_label.installEventFilter(self)
+        self.large_image_label.hide()
+        self.preview_path = None
+        self.preview_key = None
+        self.preview_movie = None
+        self.previews = PixmapCache(PREVIEW_CACHE_BYTES)
+        self.preview_loader = ImageLoader(lambda key: load_preview(*key), self, max_threads=2)
+        self.preview_loader.loaded.connect(self.preview_loaded)
+        self.create_menu()
+        self.create_toolbar()
+
+    def create_menu(self):
+        menubar = self.menuBar()
+        edit_menu = menubar.addMenu("Edit")
+        clear_action = QAction("Clear Toggles", self)
+        clear_action.triggered.connect(self.clear_toggles)
+        edit_menu.addAction(clear_action)
+        copy_action = QAction("Copy Selected to", self)
+        copy_action.triggered.connect(self.copy_selected_to)
+        edit_menu.addAction(copy_action)
+
+    def create_toolbar(self):
+        toolbar = QToolBar("View", self)
+        toolbar.setMovable(False)
+        self.addToolBar(toolbar)
+        self.filter_edit = QLineEdit(toolbar)
+        self.filter_edit.setPlaceholderText("Filter by name")
+        self.filter_edit.setClearButtonEnabled(True)
+        self.filter_edit.setMaximumWidth(250)
+        toolbar.addWidget(self.filter_edit)
+        toolbar.addWidget(QLabel(" Sort by ", toolbar))
+        self.sort_box = QComboBox(toolbar)
+        self.sort_box.addItems(list(SORT_KEYS))
+        toolbar.addWidget(self.sort_box)
+        self.descending_box = QCheckBox("Descending", toolbar)
+        toolbar.addWidget(self.descending_box)
+        self.animated_box = QCheckBox("Animated only", toolbar)
+        toolbar.addWidget(self.animated_box)
+        toolbar.addWidget(QLabel(" At least ", toolbar))
+        self.min_size_box = QSpinBox(toolbar)
+        self.min_size_box.setRange(0, 100000)
+        self.min_size_box.setSuffix(" MB")
+        self.min_size_box.setSpecialValueText("any size")
+        toolbar.addWidget(self.min_size_box)
+        # Typing is debounced; the other controls apply at once
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(FILTER_DEBOUNCE_MS)
+        self.filter_timer.timeout.connect(self.apply_view)
+        self.filter_edit.textChanged.connect(self.filter_timer.start)
+        self.min_size_box.valueChanged.connect(self.filter_timer.start)
+        self.sort_box.currentIndexChanged.connect(self.apply_view)
+        self.descending_box.toggled.connect(self.apply_view)
+        self.animated_box.toggled.connect(self.apply_view)
+
+    def apply_view(self):
+        with metrics.timer("gui.apply_view"):
+            self.filter_timer.stop()
+            self.view.reset_hover()
+            self.hide_large_image()
+            self.model.set_view(ViewOptions(self.sort_box.currentText(), self.descending_box.isChecked(),
+                                            self.filter_edit.text().strip().lower(), self.animated_box.isChecked(),
+                                            self.min_size_box.value() * 1024 * 1024))
+            self.lazy_load_images()
+
+    def clear_toggles(self):
+        self.model.clear_toggles()
+
+    def copy_selected_to(self):
+        if self.copy_worker is not None and self.copy_worker.isRunning():
+            QMessageBox.information(self, "Copy Running", "Wait for the current copy to finish or cancel it first.")
+            return
+        dialog = CopyDialog(self)
+        if dialog.exec_() == QDialog.Accepted:
+            use_thumbnails = dialog.checkbox.isChecked()
+            folder = QFileDialog.getExistingDirectory(self, "Select Folder")
+            if folder:
+                copies = plan_copies(self.model.toggled_items(), folder, use_thumbnails)
+                if not copies:
+                    return
+                # The gallery stays usable while the copy runs; the progress dialog can cancel it
+                self.copy_progress = QProgressDialog(f"Copying {len(copies)} images", "Cancel", 0, len(copies), self)
+                self.copy_progress.setWindowTitle("Copy Selected Images")
+                self.copy_progress.setMinimumDuration(500)
+                self.copy_worker = CopyWorker(copies, use_thumbnails, self.copy_workers, self)
+                self.copy_worker.progress.connect(self.copy_progressed)
+                self.copy_worker.finished.connect(self.copy_finished)
+                self.copy_progress.canceled.connect(self.copy_worker.cancel)
+                self.copy_worker.start()
+
+    def copy_progressed(self, files, copied_bytes):
+        if self.copy_progress.wasCanceled():
+            return
+        self.copy_progress.setLabelText(f"Copied {files} of {self.copy_progress.maximum()} images ({copied_bytes / (1024 * 1024):.0f} MB)")
+        self.copy_progress.setValue(files)
+
+    def copy_finished(self):
+        result = self.copy_worker.result
+        self.copy_progress.reset()
+        if result is None:
+            return
+        summary = f"{len(result.copied)} copied, {len(result.skipped)} already there"
+        if result.failed:
+            summary += f", {len(result.failed)} failed"
+        if result.cancelled:
+            QMessageBox.information(self, "Copy Cancelled", f"The copy was cancelled: {summary}.")
+        elif result.failed:
+            QMessageBox.warning(self, "Copy Completed", f"Some images could not be copied: {summary}.")
+        else:
+            QMessageBox.information(self, "Copy Completed", f"Selected images have been copied successfully: {summary}.")
+
+    def open_folder(self, original_folder, cache_resized_folder, options=DEFAULT_CACHE_OPTIONS, watch=None):
+        # Show whatever is cached right away, then stream in new and changed thumbnails.
+        # watch is None, "auto" or "poll"; the watcher starts first so nothing added during the scan is missed.
+        index = CacheIndex(cache_resized_folder)
+        entries = index.entries()
+        index.close()
+        self.add_images(entries)
+        self.original_folder = original_folder
+        self.cache_resized_folder = cache_resized_folder
+        self.cache_options = options
+        if watch:
+            self.folder_watcher = FolderWatcher(original_folder, self, poll=watch == "poll")
+            self.folder_watcher.folders_changed.connect(self.folders_changed)
+        self.start_cache_worker()
+
+    def start_cache_worker(self, folders=None, watched=False):
+        self.cache_worker = CacheWorker(self.original_folder, self.cache_resized_folder, self, self.cache_options, folders, watched)
+        self.cache_worker.images_updated.connect(self.queue_images)
+        self.cache_worker.images_removed.connect(self.remove_images)
+        self.cache_worker.metadata_updated.connect(self.update_metadata)
+        self.cache_worker.finished.connect(self.cache_finished)
+        if watched:
+            self.cache_worker.images_updated.connect(self.watched_images_made)
+        self.cache_worker.start()
+
+    def watched_images_made(self, items):
+        if self.folder_watcher is not None:
+            self.folder_watcher.files_made([item["original"] for item in items])
+
+    def folders_changed(self, folders):
+        # Only the changed folders are diffed and thumbnailed; one update runs at a time
+        if self.watched_changes is not None:
+            self.watched_changes = None if folders is None else self.watched_changes | folders
+        if self.cache_worker is None:
+            self.start_watched_update()
+
+    def start_watched_update(self):
+        folders, self.watched_changes = self.watched_changes, set()
+        if folders is None or folders:
+            self.start_cache_worker(folders, watched=True)
+
+    def cache_finished(self):
+        # Every update gets a new worker, so the finished one is deleted
+        worker, self.cache_worker = self.cache_worker, None
+        worker.deleteLater()
+        self.add_pending_images()
+        if self.folder_watcher is not None:
+            if worker.result is not None:
+                self.folder_watcher.files_made(worker.result.failed)
+            if not worker.cancelled:
+                self.start_watched_update()
+        elif not self.model.library:
+            QMessageBox.warning(self, "No Images Found", "No images were found in the selected folder.")
+
+    def queue_images(self, items):
+        self.pending_images.extend(items)
+        if not self.pending_timer.isActive():
+            self.pending_timer.start()
+
+    def add_pending_images(self):
+        items, self.pending_images = self.pending_images, []
+        if items:
+            self.add_images(items)
+
+    def add_images(self, items):
+        self.model.update_items(items)
+        self.lazy_load_images()
+
+    def update_metadata(self, entries):
+        self.model.update_metadata(entries)
+        self.lazy_load_images()
+
+    def remove_images(self, originals):
+        self.model.remove_items(originals)
+        self.lazy_load_images()
+
+    def reposition_images(self):
+        with metrics.timer("gui.reposition_images"):
+            width = self.view.viewport().width()
+            columns = max(1, width // GRID_COLUMN_WIDTH)  # Adjust the column width to reduce padding
+            # QListView wraps as soon as a row would fill the viewport exactly, hence the - 1
+            self.view.setGridSize(QSize((width - 1) // columns, GRID_ROW_HEIGHT))
+            self.lazy_load_images()
+
+    def lazy_load_images(self):
+        with metrics.timer("gui.lazy_load_images"):
+            # Decode the visible rows plus one screen in each direction on the worker pool
+            self.model.prefetch(self.view.visible_rows(margin=self.view.viewport().height()))
+            self.model.animations.update([self.model.items[row] for row in self.view.visible_rows()])
+
+    def image_hovered(self, image_path, rect):
+        self.show_large_image(image_path, rect)
+        self.show_notification(image_path, rect)
+
+    def eventFilter(self, source, event):
+        if event.type() == QEvent.Resize and source is self.view.viewport():
+            self.reposition_images()
+            self.update_large_image_position()
+        elif source == self.large_image_label and event.type() == QEvent.Enter:
+            self.large_image_label.hide()
+            return True
+        return super().eventFilter(source, event)
+
+    def show_notification(self, image_path, label_rect):
+        folder_name = os.path.basename(os.path.dirname(image_path))
+        file_name = os.path.basename(image_path)
+        if label_rect.center().x() > self.width() // 2:
+            position = 'left'
+        else:
+            position = 'right'
+        self.notification_box.show_notification(f"{folder_name}/{file_name}", position)
+
+    def closeEvent(self, event):
+        if self.copy_worker is not None:
+            self.copy_worker.stop()
+        if self.folder_watcher is not None:
+            self.folder_watcher.deleteLater()
+            self.folder_watcher = None
+        if self.cache_worker is not None:
+            self.cache_worker.stop()
+        self.model.loader.wait()
+        self.preview_loader.wait()
+        super().closeEvent(event)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.reposition_images()
+        self.update_large_image_position()
+        self.updateGeometry()  
+
+    def hide_large_image(self):
+        self.large_image_label.hide()
+        
+    def show_large_image(self, image_path, label_rect):
+        with metrics.timer("gui.show_large_image"):
+            # No stat of the original here: on a network share that alone can take longer than a
+            # frame, and a missing file just leaves the panel empty
+            self.update_large_image_position(label_rect)
+            if self.preview_movie is not None:
+                self.preview_movie.stop()
+                self.preview_movie.deleteLater()
+                self.preview_movie = None
+            if image_path.lower().endswith('.gif'):
+                self.preview_key = None
+                self.preview_movie = QMovie(image_path, parent=self)
+                if self.preview_movie.isValid():
+                    self.large_image_label.setMovie(self.preview_movie)
+                    self.preview_movie.start()
+                    # Scale the GIF to fit within the label while maintaining aspect ratio
+                    self.preview_movie.setScaledSize(self.calculate_scaled_size(self.preview_movie))
+                else:
+                    # Deleted since it was indexed, or unreadable
+                    self.large_image_label.setPixmap(QPixmap())
+            else:
+                self.request_preview(image_path)
+            self.prefetch_previews(image_path)
+            self.large_image_label.show()
+
+    def preview_size(self):
+        size = self.large_image_label.contentsRect().size()
+        return (max(1, size.width()), max(1, size.height()))
+
+    def preview_key_for(self, image_path):
+        # (source, panel size, size to enlarge to) for load_preview. The stored mid-size level is used
+        # unless the panel would show it enlarged more than PREVIEW_MAX_UPSCALE. Without the image's
+        # dimensions there is no telling how much that would be, so the original is decoded.
+        panel = self.preview_size()
+        row = self.model.rows.get(image_path)
+        item = self.model.items[row] if row is not None else {}
+        width, height = item.get("width"), item.get("height")
+        if not (item.get("preview") and width and height):
+            return (image_path, panel, None)
+        # Neither the panel nor the level enlarges an image smaller than them
+        shown = min(panel[0] / width, panel[1] / height, 1.0)
+        stored = min(PREVIEW_LEVEL_SIZE[0] / width, PREVIEW_LEVEL_SIZE[1] / height, 1.0)
+        if shown > stored * PREVIEW_MAX_UPSCALE:
+            return (image_path, panel, None)
+        if shown > stored:
+            return (item["preview"], panel, (max(1, round(width * shown)), max(1, round(height * shown))))
+        return (item["preview"], panel, None)
+
+    def request_preview(self, image_path):
+        self.preview_path = image_path
+        self.preview_key = self.preview_key_for(image_path)
+        pixmap = self.previews.get(self.preview_key)
+        if pixmap is None:
+            # Show the grid thumbnail blown up until the worker has decoded the real preview
+            item = self.model.items[self.model.rows[image_path]] if image_path in self.model.rows else None
+            thumbnail = self.model.pixmaps.get(item["resized"]) if item else None
+            if thumbnail is not None:
+                pixmap = thumbnail.scaled(QSize(*self.preview_key[1]), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            else:
+                pixmap = QPixmap()
+            self.preview_loader.request(self.preview_key)
+        self.large_image_label.setPixmap(pixmap)
+
+    def prefetch_previews(self, image_path):
+        # Decode the neighbors of the hovered tile after it and forget requests for older tiles
+        wanted = {self.preview_key} if self.preview_key else set()
+        row = self.model.rows.get(image_path)
+        if row is not None:
+            for neighbor in self.view.neighbor_rows(row):
+                path = self.model.items[neighbor]["original"]
+                if path.lower().endswith('.gif'):
+                    continue
+                key = self.preview_key_for(path)
+                wanted.add(key)
+                if key not in self.previews:
+                    self.preview_loader.request(key)
+        if self.preview_key:
+            # Requested last so it is decoded first
+            self.preview_loader.request(self.preview_key)
+        self.preview_loader.discard_except(wanted)
+
+    def preview_loaded(self, key, image):
+        self.previews.put(key, QPixmap.fromImage(image))
+        if key == self.preview_key:
+            self.large_image_label.setPixmap(self.previews.get(key))
+
+    def calculate_scaled_size(self, movie):
+        original_size = movie.currentImage().size()
+        label_size = self.large_image_label.size()
+        if original_size.width() <= 0 or original_size.height() <= 0:
+            return label_size
+        aspect_ratio = original_size.width() / original_size.height()
+        if label_size.width() / aspect_ratio <= label_size.height():
+            return QSize(label_size.width(), int(label_size.width() / aspect_ratio))
+        else:
+            return QSize(int(label_size.height() * aspect_ratio), label_size.height())
+
+    def update_large_image_position(self, label_rect=None):
+        if not hasattr(self, 'large_image_label') or self.large_image_label is None:
+            return  # Exit the method if large_image_label doesn't exist
+        if label_rect is not None:
+            if label_rect.center().x() > self.width() // 2:
+                self.large_image_label.setGeometry(0, 0, self.width() // 2, self.height())
+            else:
+                self.large_image_label.setGeometry(self.width() // 2, 0, self.width() // 2, self.height())
+        else:
+            self.large_image_label.setGeometry(self.width() // 2, 0, self.width() // 2, self.height())
+        # A resized panel gets a preview decoded for its new size
+        if self.preview_key and self.preview_key[1] != self.preview_size() and self.large_image_label.isVisible():
+            self.request_preview(self.preview_path)
+
+
+def run(original_folder, cache_resized_folder, options=DEFAULT_CACHE_OPTIONS, argv=None, watch=None, copy_workers=COPY_WORKERS):
+    app = QApplication.instance() or QApplication(argv or [])
+    gallery = ImageGallery()
+    gallery.copy_workers = copy_workers
+    gallery.show()
+    gallery.open_folder(original_folder, cache_resized_folder, options, watch)
+    return app.exec_()
@@ -0,0 +1,109 @@
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import gallery  # noqa: E402
+
+IMAGES = 64
+
+# Runs update_cache in its own process and prints what it made
+BUILDER = """
+import json, sys
+sys.path.insert(0, {repo!r})
+import gallery
+result = gallery.update_cache({src!r}, {cache!r}, workers=2, batch_size=4, options=gallery.CacheOptions(*{options!r}))
+print(json.dumps({{"done": result.done, "failed": result.failed, "skipped": list(result.skipped)}}))
+"""
+
+OPTIONS = {
+    "files": ("files", "gif", None),
+    "pack": ("pack", "gif", None),
+    "store": ("files", "gif", "store"),
+}
+
+
+@pytest.fixture
+def originals(tmp_path):
+    src = tmp_path / "src"
+    for i in range(IMAGES):
+        folder = src / f"folder{i % 4}"
+        folder.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", (320 + i, 240), (i * 3, 80, 160)).save(folder / f"image{i:03d}.jpg")
+    return sorted(str(path) for path in src.rglob("*.jpg"))
+
+
+def index_rows(cache):
+    conn = sqlite3.connect(os.path.join(cache, gallery.CacheIndex.FILE_NAME))
+    try:
+        return conn.execute("SELECT original, resized FROM images").fetchall()
+    finally:
+        conn.close()
+
+
+def options_for(name, tmp_path):
+    cache_format, animation_format, store = OPTIONS[name]
+    return (cache_format, animation_format, store and str(tmp_path / store))
+
+
+@pytest.mark.parametrize("name", sorted(OPTIONS))
+def test_two_builders_share_one_cache(tmp_path, originals, name):
+    cache = str(tmp_path / "cache")
+    script = BUILDER.format(repo=REPO, src=str(tmp_path / "src"), cache=cache, options=options_for(name, tmp_path))
+    builders = [subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, text=True) for _ in range(2)]
+    results = []
+    for builder in builders:
+        output, _ = builder.communicate(timeout=300)
+        assert builder.returncode == 0
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    # Every image made by exactly one of them, and nothing failed or was left over
+    assert sum(result["done"] for result in results) == IMAGES
+    assert all(not result["failed"] and not result["skipped"] for result in results)
+    rows = index_rows(cache)
+    assert sorted(original for original, resized in rows) == originals
+    assert len({resized for original, resized in rows}) == IMAGES
+    assert not os.listdir(os.path.join(cache, "claims"))
+
+
+def test_claim_of_dead_builder_is_taken_over(tmp_path, originals):
+    cache = str(tmp_path / "cache")
+    claims = os.path.join(cache, "claims")
+    os.makedirs(claims)
+    # A pid that was in use a moment ago and is gone now
+    finished = subprocess.Popen([sys.executable, "-c", "pass"])
+    finished.wait()
+    with open(gallery.claim_path(claims, originals[0]), "w") as claim:
+        claim.write(f"{socket.gethostname()} {finished.pid}")
+
+    result = gallery.update_cache(str(tmp_path / "src"), cache, workers=2, batch_size=4, claim_wait=60)
+
+    assert result.done == IMAGES
+    assert not result.skipped
+    assert sorted(original for original, resized in index_rows(cache)) == originals
+    assert not os.listdir(claims)
+
+
+def test_claim_nobody_releases_is_skipped(tmp_path, originals):
+    cache = str(tmp_path / "cache")
+    claims = os.path.join(cache, "claims")
+    os.makedirs(claims)
+    # Held by a live process that never gets to it, as after a crash on another machine or with a reused pid
+    held = gallery.claim_path(claims, originals[0])
+    with open(held, "w") as claim:
+        claim.write(f"{socket.gethostname()} {os.getpid()}")
+
+    result = gallery.update_cache(str(tmp_path / "src"), cache, workers=2, batch_size=4, claim_wait=0.5)
+
+    assert result.done == IMAGES - 1
+    assert list(result.skipped) == [originals[0]]
+    assert sorted(original for original, resized in index_rows(cache)) == originals[1:]
+    assert os.listdir(claims) == [os.path.basename(held)]
@@ -0,0 +1,37 @@
+import os
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gallery  # noqa: E402
+
+
+def test_failed_original_waits_until_it_changes(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    Image.new("RGB", (320, 240)).save(src / "good.jpg")
+    broken = src / "broken.jpg"
+    broken.write_bytes(b"\xff\xd8\xff\xe0 not a whole jpeg")
+    cache = str(tmp_path / "cache")
+
+    result = gallery.update_cache(str(src), cache, workers=1)
+    assert result.failed == [str(broken)]
+
+    # Watched updates leave it alone while it is unchanged; a full build tries it again
+    index = gallery.CacheIndex(cache)
+    try:
+        assert index.diff(str(src), retry_failed=False) == gallery.CacheChanges([], [], [])
+        assert [path for path, size, mtime_ns in index.diff(str(src)).added] == [str(broken)]
+    finally:
+        index.close()
+
+    Image.new("RGB", (320, 240)).save(broken)
+    result = gallery.update_cache(str(src), cache, workers=1, retry_failed=False)
+    assert result.done == 1 and not result.failed
+    index = gallery.CacheIndex(cache)
+    try:
+        assert not index.conn.execute("SELECT * FROM failed").fetchall()
+    finally:
+        index.close()